@@ -0,0 +1,205 @@
+import pandas as pd
+import numpy as np
+import os
+import argparse
+
+ledger_root = "./allocation_money"
+# league allocations by condition; additional_allocations.csv is these concatenated, so it isn't read on its own
+allocation_tables = ["ccl", "expansion", "expansion_draft", "leagues_cup", "playoffs"]
+# allocation tables spell a few clubs differently from the trade db
+club_aliases = {
+    "Colorado" : "Colorado Rapids",
+    "Minnesota United" : "Minnesota",
+    "Portland Timbers" : "Portland",
+}
+# opening balances (base budgets) sort before every dated entry
+opening_date = np.datetime64("1900-01-01", "D")
+
+def load_trades(root = ledger_root):
+    trades = pd.read_csv(f"{root}/mls_trade_db.csv")
+    trades["trade_date"] = pd.to_datetime(trades["trade_date"]).to_numpy().astype("datetime64[D]")
+    return trades
+
+def trade_entries(trades):
+    # every acquired asset of a two-club trade is +value for the club that got it and -value for the other one; trades with more clubs don't say who gave what and are skipped, like the notebook does
+    clubs = trades.groupby("trade_id")["club"].agg(["first", "last", "nunique"])
+    skipped = clubs.index[clubs["nunique"] != 2]
+    for trade_id in skipped:
+        print(f"trade_id {trade_id} had weird number of teams: {clubs.loc[trade_id, 'nunique']}, skipping it")
+    rows = trades[trades["trade_id"].isin(clubs.index[clubs["nunique"] == 2])]
+    pair = clubs.loc[rows["trade_id"]]
+    counterparty = np.where(rows["club"].to_numpy() == pair["first"].to_numpy(), pair["last"].to_numpy(), pair["first"].to_numpy())
+
+    acquired = pd.DataFrame({
+        "date" : rows["trade_date"].to_numpy(),
+        "club" : rows["club"].to_numpy(),
+        "asset_year" : rows["asset_year"].to_numpy(dtype=np.int64),
+        "gam" : rows["gam_value"].to_numpy(dtype=np.int64),
+        "tam" : rows["tam_value"].to_numpy(dtype=np.int64),
+        "source" : "trade",
+        "reference" : rows["trade_id"].to_numpy(),
+        "description" : rows["acquired_asset_value"].to_numpy(),
+    })
+    traded = acquired.assign(club=counterparty, gam=-acquired["gam"], tam=-acquired["tam"])
+    return pd.concat([acquired, traded], ignore_index=True)
+
+def allocation_entries(root = ledger_root):
+    # league allocations land on Jan 1 of their season, GAM only
+    frames = [pd.read_csv(f"{root}/{t}_allocations.csv") for t in allocation_tables]
+    allocations = pd.concat(frames, ignore_index=True)
+    allocations["club"] = allocations["club"].replace(club_aliases)
+    return pd.DataFrame({
+        "date" : pd.to_datetime(allocations["season"].astype(str) + "-01-01").to_numpy().astype("datetime64[D]"),
+        "club" : allocations["club"].to_numpy(),
+        "asset_year" : allocations["season"].to_numpy(dtype=np.int64),
+        "gam" : allocations["gam_value"].to_numpy(dtype=np.int64),
+        "tam" : np.zeros(len(allocations), dtype=np.int64),
+        "source" : "allocation",
+        "reference" : allocations["allocation_condition"].to_numpy(),
+        "description" : allocations["allocation_condition"].to_numpy(),
+    })
+
+def base_budgets(root = ledger_root):
+    budgets = pd.read_csv(f"{root}/base_mls_am_budgets.csv")
+    return pd.DataFrame({
+        "club" : budgets["club"].to_numpy(),
+        "asset_year" : budgets["year"].to_numpy(dtype=np.int64),
+        "gam" : budgets["base_gam"].to_numpy(dtype=np.int64),
+        "tam" : budgets["base_tam"].to_numpy(dtype=np.int64),
+    })
+
+class Ledger:
+    # every entry sorted by (club, asset year, date) with GAM/TAM running balances per club-asset year, so a balance on any date is one binary search
+    def __init__(self, entries, opening):
+        self.clubs = np.array(sorted(set(entries["club"]) | set(opening["club"])), dtype=object)
+        self.years = np.arange(min(entries["asset_year"].min(), opening["asset_year"].min()), max(entries["asset_year"].max(), opening["asset_year"].max()) + 1)
+        n_keys = len(self.clubs) * len(self.years)
+
+        keys = self.key(entries["club"].to_numpy(), entries["asset_year"].to_numpy())
+        days = entries["date"].to_numpy().astype("datetime64[D]").astype(np.int64)
+        order = np.lexsort((days, keys))
+        self.entries = entries.iloc[order].reset_index(drop=True)
+        self.keys = keys[order]
+        self.days = days[order]
+        # (key, day) packed into one sortable int64 for the vectorized lookups
+        self.span = int(max(self.days.max(), 0) - opening_date.astype(np.int64) + 2) if len(self.days) > 0 else 2
+        self.packed = self.keys * self.span + (self.days - opening_date.astype(np.int64))
+        # entries of key k are bounds[k]:bounds[k + 1]
+        self.bounds = np.searchsorted(self.keys, np.arange(n_keys + 1))
+
+        self.opening = np.zeros((n_keys, 2), dtype=np.int64)
+        np.add.at(self.opening, self.key(opening["club"].to_numpy(), opening["asset_year"].to_numpy()), opening[["gam", "tam"]].to_numpy(dtype=np.int64))
+        # grouped cumulative sum: a running total over everything minus the total before the key's first entry
+        amounts = self.entries[["gam", "tam"]].to_numpy(dtype=np.int64)
+        totals = np.cumsum(amounts, axis=0)
+        before = np.vstack([np.zeros((1, 2), dtype=np.int64), totals])[self.bounds[:-1]]
+        self.running = totals - before[self.keys] + self.opening[self.keys]
+
+    def key(self, clubs, years):
+        club = pd.Index(self.clubs).get_indexer(np.asarray(clubs, dtype=object))
+        if (club < 0).any():
+            raise KeyError(f"unknown club(s): {sorted(set(np.asarray(clubs, dtype=object)[club < 0]))}")
+        years = np.asarray(years, dtype=np.int64)
+        if ((years < self.years[0]) | (years > self.years[-1])).any():
+            raise KeyError(f"asset years outside {self.years[0]}-{self.years[-1]}")
+        return club * len(self.years) + (years - self.years[0])
+
+    def day(self, date):
+        # None means after every entry
+        if date is None:
+            return int(self.days.max()) if len(self.days) > 0 else int(opening_date.astype(np.int64))
+        return int(np.datetime64(pd.Timestamp(date).date(), "D").astype(np.int64))
+
+    def lookup(self, keys, day):
+        # (gam, tam) balances of these keys at the end of `day`
+        keys = np.asarray(keys, dtype=np.int64)
+        offset = max(day - int(opening_date.astype(np.int64)), -1)
+        position = np.searchsorted(self.packed, keys * self.span + min(offset, self.span - 1), side="right") - 1
+        found = (position >= self.bounds[keys]) & (offset >= 0)
+        return np.where(found[:, None], self.running[np.maximum(position, 0)], self.opening[keys])
+
+    def balance(self, club, asset_year, date = None):
+        # (GAM, TAM) club had of asset_year money at the end of date (default: after everything in the ledger)
+        gam, tam = self.lookup(self.key([club], [asset_year]), self.day(date))[0]
+        return int(gam), int(tam)
+
+    def flow(self, club, asset_year, start, end):
+        # net (GAM, TAM) moved in [start, end], both ends inclusive
+        key = self.key([club], [asset_year])
+        before = self.lookup(key, self.day(start) - 1)[0]
+        after = self.lookup(key, self.day(end))[0]
+        return int(after[0] - before[0]), int(after[1] - before[1])
+
+    def snapshot(self, date = None, clubs = None, asset_years = None):
+        # every club x asset year balance at the end of date
+        clubs = self.clubs if clubs is None else np.asarray(clubs, dtype=object)
+        asset_years = self.years if asset_years is None else np.asarray(asset_years, dtype=np.int64)
+        club_grid = np.repeat(clubs, len(asset_years))
+        year_grid = np.tile(asset_years, len(clubs))
+        balances = self.lookup(self.key(club_grid, year_grid), self.day(date))
+        day = self.day(date)
+        return pd.DataFrame({
+            "date" : str(np.datetime64(day, "D")),
+            "club" : club_grid,
+            "asset_year" : year_grid,
+            "gam" : balances[:, 0],
+            "tam" : balances[:, 1],
+            "xam" : balances.sum(axis=1),
+        })
+
+    def history(self, club, asset_year):
+        # the club-asset year's entries in date order with the balance after each
+        k = self.key([club], [asset_year])[0]
+        lo, hi = self.bounds[k], self.bounds[k + 1]
+        rows = self.entries.iloc[lo:hi].copy()
+        rows["gam_balance"] = self.running[lo:hi, 0]
+        rows["tam_balance"] = self.running[lo:hi, 1]
+        return rows.reset_index(drop=True)
+
+def load_ledger(root = ledger_root):
+    entries = pd.concat([trade_entries(load_trades(root)), allocation_entries(root)], ignore_index=True)
+    ledger = Ledger(entries, base_budgets(root))
+    print(f"Loaded {len(entries)} allocation money entries for {len(ledger.clubs)} clubs and asset years {ledger.years[0]}-{ledger.years[-1]}")
+    return ledger
+
+def write_snapshots(ledger, dates, path):
+    snapshots = pd.concat([ledger.snapshot(d) for d in dates], ignore_index=True)
+    snapshots.to_csv(path, index=False)
+    print(f"Wrote {len(snapshots)} balances for {len(dates)} dates to {path}")
+    return snapshots
+
+def check(ledger, root = ledger_root):
+    # the final balances against the notebook's mls_am_budgets.csv (base + trade delta + additional GAM)
+    budgets = pd.read_csv(f"{root}/mls_am_budgets.csv")
+    final = ledger.lookup(ledger.key(budgets["club"].to_numpy(), budgets["year"].to_numpy()), ledger.day(None))
+    mismatched = (final[:, 0] != budgets["available_gam"].to_numpy()) | (final[:, 1] != budgets["available_tam"].to_numpy())
+    for _, row in budgets[mismatched].iterrows():
+        print(f"{row['year']} {row['club']}: notebook has {row['available_gam']:.0f} GAM / {row['available_tam']:.0f} TAM")
+    print(f"{len(budgets) - mismatched.sum()} of {len(budgets)} budget rows match mls_am_budgets.csv")
+    return mismatched.sum() == 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Point-in-time GAM/TAM balances from the allocation money tables")
+    parser.add_argument("--club", help="print this club's balance (needs --year)")
+    parser.add_argument("--year", type=int, help="asset year of the balance")
+    parser.add_argument("--date", help="balance at the end of this date (YYYY-MM-DD), defaults to after every entry")
+    parser.add_argument("--since", help="with --club, also print the net GAM/TAM moved between this date and --date")
+    parser.add_argument("--history", action="store_true", help="with --club, print every entry and the running balance")
+    parser.add_argument("--snapshot", action="append", metavar="DATE", help="write every club's balances on this date (repeatable) to --out")
+    parser.add_argument("--out", default=f"{ledger_root}/balance_snapshots.csv")
+    parser.add_argument("--check", action="store_true", help="compare final balances against mls_am_budgets.csv")
+    args = parser.parse_args()
+
+    ledger = load_ledger()
+    if args.club:
+        gam, tam = ledger.balance(args.club, args.year, args.date)
+        print(f"{args.club} {args.year} allocation money at {args.date or 'the end of the ledger'}: {gam} GAM, {tam} TAM")
+        if args.since:
+            gam, tam = ledger.flow(args.club, args.year, args.since, args.date)
+            print(f"Net change {args.since} to {args.date or 'the end of the ledger'}: {gam:+d} GAM, {tam:+d} TAM")
+        if args.history:
+            print(ledger.history(args.club, args.year).to_string(index=False))
+    if args.snapshot:
+        write_snapshots(ledger, args.snapshot, args.out)
+    if args.check and not check(ledger):
+        raise SystemExit(1)
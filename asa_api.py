@@ -0,0 +1,283 @@
+import pandas as pd
+import io
+import os
+import time
+import threading
+import fcntl
+import hashlib
+import json
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, quote, urlparse
+
+from instrument import span, track_counters
+
+# point at a local stub server with e.g. ASA_API_BASE=http://127.0.0.1:8000/api/v1
+base_url = os.environ.get("ASA_API_BASE", "https://app.americansocceranalysis.com/api/v1")
+default_rate = float(os.environ.get("ASA_API_RATE", "2"))
+default_workers = int(os.environ.get("ASA_API_WORKERS", "4"))
+# ASA_RATE_FILE=<path> makes every client in every process draw from one token bucket kept in that file, so parallel jobs share ASA_API_RATE instead of each getting it
+shared_rate_path = os.environ.get("ASA_RATE_FILE")
+retry_statuses = [429, 500, 502, 503, 504]
+
+cache_dir = os.environ.get("ASA_CACHE_DIR", "./.asa_cache")
+cache_max_bytes = int(os.environ.get("ASA_CACHE_MAX_MB", "2048")) * 1024 * 1024
+cache_enabled = os.environ.get("ASA_CACHE", "1") != "0"
+# ASA_OFFLINE=1 serves every request from the cache and fails on a miss
+offline = os.environ.get("ASA_OFFLINE", "0") == "1"
+
+# seconds a cached response is served without asking ASA, first endpoint suffix that matches wins
+cache_ttls = [
+    ("/goals-added", 12 * 60 * 60),
+    ("/xgoals", 24 * 60 * 60),
+    ("/players", 7 * 24 * 60 * 60),
+    ("/teams", 7 * 24 * 60 * 60),
+]
+default_ttl = 12 * 60 * 60
+
+def season_label(competition, yr):
+    # euro calendar competitions name seasons like 2024-25
+    if competition == "usls":
+        return f"{str(yr)}-{str(yr+1)[2:]}"
+    return str(yr)
+
+class TokenBucket:
+    def __init__(self, rate, burst = 1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        # blocks until a request is allowed under the configured rate
+        if shared_rate_path:
+            return self.take_shared(shared_rate_path)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def take_shared(self, path):
+        # same bucket, but its state is read and written back under an exclusive file lock, so every process holding it stays under one rate together
+        while True:
+            with self.lock, open(path, "a+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.seek(0)
+                text = f.read()
+                now = time.time()
+                state = json.loads(text) if text else { "tokens" : self.capacity, "updated" : now }
+                tokens = min(self.capacity, state["tokens"] + max(now - state["updated"], 0) * self.rate)
+                wait = 0 if tokens >= 1 else (1 - tokens) / self.rate
+                if tokens >= 1:
+                    tokens -= 1
+                f.seek(0)
+                f.truncate()
+                json.dump({ "tokens" : tokens, "updated" : now }, f)
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+def share_rate_limit(path):
+    # from here on (and in processes started after this) every TokenBucket draws from the bucket in `path`
+    global shared_rate_path
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    shared_rate_path = path
+    os.environ["ASA_RATE_FILE"] = path
+
+def cache_ttl(url):
+    path = urlparse(url).path
+    for (suffix, ttl) in cache_ttls:
+        if path.endswith(suffix):
+            return ttl
+    return default_ttl
+
+class ResponseCache:
+    # response bodies keyed by the sha256 of their URL, with a sidecar for validators and fetch time
+    def __init__(self, directory = None, max_bytes = None):
+        self.directory = directory or cache_dir
+        self.max_bytes = max_bytes or cache_max_bytes
+        self.lock = threading.Lock()
+        self.total_bytes = None
+
+    def paths(self, url):
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        folder = os.path.join(self.directory, key[:2])
+        return os.path.join(folder, f"{key}.json"), os.path.join(folder, f"{key}.meta.json")
+
+    def get(self, url):
+        body_path, meta_path = self.paths(url)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            with open(body_path, encoding="utf-8") as f:
+                body = f.read()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # reads count as use for LRU eviction
+        os.utime(body_path)
+        return body, meta
+
+    def is_fresh(self, meta):
+        return (time.time() - meta["fetched_at"]) < cache_ttl(meta["url"])
+
+    def write_atomic(self, path, text):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def put(self, url, body, headers):
+        body_path, meta_path = self.paths(url)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        meta = {
+            "url" : url,
+            "fetched_at" : time.time(),
+            "etag" : headers.get("ETag"),
+            "last_modified" : headers.get("Last-Modified")
+        }
+        previous = os.path.getsize(body_path) if os.path.exists(body_path) else 0
+        self.write_atomic(body_path, body)
+        self.write_atomic(meta_path, json.dumps(meta))
+
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = self.scan_size()
+            else:
+                self.total_bytes += os.path.getsize(body_path) - previous
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def revalidated(self, url, meta):
+        # a 304 means the cached body is current again
+        meta["fetched_at"] = time.time()
+        self.write_atomic(self.paths(url)[1], json.dumps(meta))
+
+    def entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json") and not name.endswith(".meta.json"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    yield path, stat.st_mtime, stat.st_size
+
+    def scan_size(self):
+        return sum(size for (_, _, size) in self.entries())
+
+    def evict(self):
+        # drop least recently used bodies until the cache is back under its size bound
+        for path, _, size in sorted(self.entries(), key=lambda e: e[1]):
+            if self.total_bytes <= self.max_bytes:
+                break
+            for stale in [path, path[:-len(".json")] + ".meta.json"]:
+                if os.path.exists(stale):
+                    os.remove(stale)
+            self.total_bytes -= size
+
+class AsaClient:
+    def __init__(self, base = None, rate = None, burst = None, workers = None, retries = 5, backoff = 2.0, timeout = 120, cache = None, offline = offline):
+        self.base = (base or base_url).rstrip("/")
+        self.workers = workers or default_workers
+        self.bucket = TokenBucket(rate or default_rate, burst or self.workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.cache = cache if cache is not None else (ResponseCache() if cache_enabled else None)
+        self.offline = offline
+        self.request_count = 0
+        self.retry_count = 0
+        self.cache_hits = 0
+        self.lock = threading.Lock()
+        track_counters(self)
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def url(self, path, **params):
+        # keep commas in id lists and encode spaces as %20, like the hand-built URLs did
+        query = urlencode(params, quote_via=quote, safe=",")
+        return f"{self.base}/{path}?{query}" if query else f"{self.base}/{path}"
+
+    def retry_delay(self, response, attempt):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * (2 ** attempt)
+
+    def request(self, url, headers):
+        for attempt in range(self.retries + 1):
+            self.bucket.take()
+            with self.lock:
+                self.request_count += 1
+            response = None
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                if response.status_code not in retry_statuses:
+                    response.raise_for_status()
+                    return response
+                error = requests.HTTPError(f"{response.status_code} from {url}", response=response)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+
+            if attempt == self.retries:
+                raise error
+            delay = self.retry_delay(response, attempt)
+            with self.lock:
+                self.retry_count += 1
+            print(f"Retrying {url} in {delay}s after: {error}")
+            time.sleep(delay)
+
+    def get_text(self, url):
+        cached = self.cache.get(url) if self.cache is not None else None
+        if cached is not None and (self.offline or self.cache.is_fresh(cached[1])):
+            with self.lock:
+                self.cache_hits += 1
+            return cached[0]
+        if self.offline:
+            raise RuntimeError(f"{url} is not in the response cache at {self.cache.directory if self.cache else None} and offline mode is on")
+
+        headers = {}
+        if cached is not None:
+            if cached[1].get("etag"):
+                headers["If-None-Match"] = cached[1]["etag"]
+            if cached[1].get("last_modified"):
+                headers["If-Modified-Since"] = cached[1]["last_modified"]
+
+        response = self.request(url, headers)
+        if response.status_code == 304 and cached is not None:
+            self.cache.revalidated(url, cached[1])
+            with self.lock:
+                self.cache_hits += 1
+            return cached[0]
+
+        # JSON is always utf-8, skip requests' (slow) charset sniffing
+        text = response.content.decode("utf-8")
+        if self.cache is not None:
+            self.cache.put(url, text, response.headers)
+        return text
+
+    def read_json(self, url):
+        return pd.read_json(io.StringIO(self.get_text(url)))
+
+    def get_json(self, url):
+        return json.loads(self.get_text(url))
+
+    def fetch_all(self, urls, reader = None):
+        # results come back in the same order as `urls`, as DataFrames unless another reader (e.g. get_json) is given
+        reader = reader or self.read_json
+        if len(urls) == 0:
+            return []
+        endpoint = urlparse(urls[0]).path[len(urlparse(self.base).path):].lstrip("/")
+        with span("fetch", endpoint=endpoint, urls=len(urls)) as s:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(reader, urls))
+            s["rows"] = sum(len(r) for r in results)
+        return results
@@ -5,285 +5,230 @@ import math
 import time
 import datetime
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from percentiles import group_quantiles
+from leaderboards import build_rank_index, save_rank_index
+from breakdown import team_breakdown
+from asa_api import AsaClient, season_label
+from parquet_store import write_outputs
+from ranks_store import write_ranks
+from sketches import build_sketches, compression_for, save_sketches, default_error
+from similarity import player_profiles, save_profiles, SimilarityIndex
+from gplus_schema import flatten_records, apply_schema, save_snapshot, load_snapshot, snapshot_valid
+import instrument
+from instrument import span
 
 current_date_time = datetime.datetime.now()
 year = current_date_time.date().strftime("%Y")
 year = int(year)
 next_year = int(year) + 1
-base_range = np.linspace(0.01, 1.00, 100)
 
-def retrieve_data(competition, start_year, end_year, split_by_game = False, split_by_seasons = True):
-    print(f"Grabbing {competition} G+ data from ASA...")
-    gplus_data = pd.DataFrame()
-    for yr in range(start_year, end_year):
-        time.sleep(3)
-
-        if competition == "usls":
-            yr_str = f"{str(yr)}-{str(yr+1)[2:]}"
-        else:
-            yr_str = str(yr)
-       
-        url = f"https://app.americansocceranalysis.com/api/v1/{competition}/players/goals-added?season_name={yr_str}&split_by_teams=true&split_by_seasons={split_by_seasons}&split_by_games={split_by_game}"
-        print(f"Grabbing data for {competition} field players in {yr_str} with params: split_by_game = {split_by_game}, split_by_seasons = {split_by_seasons}: {url}") 
-        tmp = pd.read_json(url)
-        tmp['season'] = yr
-        
-        gk_url = f"https://app.americansocceranalysis.com/api/v1/{competition}/goalkeepers/goals-added?season_name={yr_str}&split_by_teams=true&split_by_seasons={split_by_seasons}&split_by_games={split_by_game}"
-        print(f"Grabbing data for {competition} GKs in {yr_str} with params: split_by_game = {split_by_game}, split_by_seasons = {split_by_seasons}: {gk_url}")
-        tmp_gk = pd.read_json(gk_url)
-        tmp_gk["general_position"] = "GK"
-        tmp_gk['season'] = yr
-        
-        gplus_data = pd.concat([gplus_data, tmp, tmp_gk], ignore_index=True)
-    
-    json_gk_expl_txt = json.loads(gplus_data.explode('data').to_json(orient="records"))
-    return pd.json_normalize(json_gk_expl_txt)
-
-def action_percentiles(base, position, action_type, year):
-    slice_gplus = base[(base.general_position == position) & (base["data.action_type"] == action_type) & (base.season == year)]
-    if (len(slice_gplus) == 0):
-        # print(f"no data for Combo of {position} / {action_type}")
-        return pd.DataFrame()
+snapshot_root = "./snapshots"
+# GPLUS_RANKS_CSV=0 only writes the normalized ranks/ files, not the long player-g+-ranks.csv
+ranks_csv = os.environ.get("GPLUS_RANKS_CSV", "1") != "0"
+client = AsaClient()
 
-    print(f"Compiling data for combo of {position} / {action_type} / {year}") 
-    data = slice_gplus["data.goals_added_raw"]
-    adj_data = slice_gplus["data.goals_added_raw_p96"]
-    return pd.DataFrame({ "position" : position, "action_type" : action_type, "season" : year, "pct" : base_range, "p96" : adj_data.quantile(base_range), "pSzn" : data.quantile(base_range)})
+def is_open_season(competition, yr):
+    # euro calendar seasons (usls) run into the following year
+    last_year = yr + 1 if competition == "usls" else yr
+    return last_year >= year
 
-def total_percentiles(base, position, year):
-    slice_gplus = base[(base.general_position == position) & (base.season == year)]
-    grouped_slice = slice_gplus.groupby(['season_name','player_id']).agg({
-        'data.goals_added_raw': ['sum'], 
-        'minutes_played' : ['mean']
-    }).reset_index()
-    grouped_slice.columns = grouped_slice.columns.droplevel(level=1)
-    grouped_slice['total'] = grouped_slice['data.goals_added_raw']
-    grouped_slice['p96'] = grouped_slice['data.goals_added_raw'] * 96 / grouped_slice["minutes_played"]
+def snapshot_path(competition, yr):
+    return f"{snapshot_root}/{competition}/{yr}.pkl"
 
-    if (len(grouped_slice) == 0):
-        # print(f"no data for Combo of {position} / {action_type}")
-        return pd.DataFrame()
-
-    print(f"Compiling data for combo of {position} / {year}") 
-    data = grouped_slice["total"]
-    adj_data = grouped_slice["p96"]
-    return pd.DataFrame({ "position" : position, "season" : year, "pct" : base_range, "p96" : adj_data.quantile(base_range), "pSzn" : data.quantile(base_range)})
-
-def rank_players(base, year, team: str = None, position: str = None, action_type: str = None):
-    print(f"Ranking players for combo of {year} - {position} - {action_type}")
+def gplus_urls(competition, yr, split_by_game = False, split_by_seasons = True):
+    params = { "season_name" : season_label(competition, yr), "split_by_teams" : "true", "split_by_seasons" : split_by_seasons, "split_by_games" : split_by_game }
+    return [
+        client.url(f"{competition}/players/goals-added", **params),
+        client.url(f"{competition}/goalkeepers/goals-added", **params)
+    ]
 
-    slice_gplus = base[(base.season == year)]
-    max_minutes = slice_gplus["minutes_played"].max()
-    print(f"Found max minutes in season: {max_minutes}")
-    max_games = math.floor(max_minutes / 96)
-    print(f"Found max games played in season: {max_games}")
-    
-    rank_threshold_gm = max_games * 0.25
-    rank_threshold_min = rank_threshold_gm * 96
-    print(f"leaderboard threshold by games is {rank_threshold_gm}, by minutes is {rank_threshold_min}")
+def explode_season(competition, yr, records, gk_records):
+    # flatten each player's per-action G+ list straight from the payload into typed columns
+    gplus_data = pd.concat([
+        flatten_records(records, extra={ "season" : yr }),
+        flatten_records(gk_records, extra={ "general_position" : "GK", "season" : yr })
+    ], ignore_index=True)
+    if len(gplus_data) == 0:
+        print(f"No G+ data found for {competition} in {season_label(competition, yr)}")
+        return pd.DataFrame()
 
-    slice_gplus = slice_gplus[slice_gplus.minutes_played >= rank_threshold_min]
+    return apply_schema(gplus_data)
 
-    if (team != None):
-        slice_gplus = slice_gplus[(slice_gplus.team_id == team)]
+def retrieve_seasons(competition, years, split_by_game = False, split_by_seasons = True):
+    urls = [url for yr in years for url in gplus_urls(competition, yr, split_by_game, split_by_seasons)]
+    print(f"Grabbing {competition} field player and GK data for {len(years)} seasons with params: split_by_game = {split_by_game}, split_by_seasons = {split_by_seasons}")
+    payloads = client.fetch_all(urls, client.get_json)
+    seasons = {}
+    for i, yr in enumerate(years):
+        with span("explode", competition=competition, season=yr) as s:
+            seasons[yr] = explode_season(competition, yr, payloads[2 * i], payloads[2 * i + 1])
+            s["rows"] = len(seasons[yr])
+    return seasons
 
-    if (position != None):
-        slice_gplus = slice_gplus[(slice_gplus.general_position == position)]
+def retrieve_data(competition, start_year, end_year, split_by_game = False, split_by_seasons = True):
+    print(f"Grabbing {competition} G+ data from ASA...")
+    seasons = retrieve_seasons(competition, list(range(start_year, end_year)), split_by_game, split_by_seasons)
+    return apply_schema(pd.concat(seasons.values(), ignore_index=True))
+
+def load_competition(competition, start_year, end_year, full_refresh = False, stale = []):
+    # closed seasons come from their local snapshot, open/stale/missing ones are re-pulled from ASA
+    print(f"Loading {competition} G+ data for {start_year} to {end_year - 1} (full refresh: {full_refresh})...")
+    years = list(range(start_year, end_year))
+    outdated = [yr for yr in years if os.path.exists(snapshot_path(competition, yr)) and not snapshot_valid(snapshot_path(competition, yr))]
+    if len(outdated) > 0:
+        print(f"Snapshots for {outdated} were written by another pandas/numpy version or schema, re-pulling them")
+    to_fetch = [yr for yr in years if full_refresh or (yr in stale) or is_open_season(competition, yr) or not snapshot_valid(snapshot_path(competition, yr))]
+    fetched = retrieve_seasons(competition, to_fetch)
+
+    seasons = []
+    for yr in years:
+        path = snapshot_path(competition, yr)
+        with span("snapshot", competition=competition, season=yr, fetched=yr in fetched) as s:
+            if yr in fetched:
+                tmp = fetched[yr]
+                save_snapshot(tmp, path)
+            else:
+                tmp = load_snapshot(path)
+            s["rows"] = len(tmp)
+        seasons.append(tmp)
+    print(f"Pulled {len(fetched)} seasons from ASA and {len(years) - len(fetched)} from snapshots for {competition}")
+    # categoricals only survive concat when every season shares categories, so re-apply the schema to the merged frame
+    return apply_schema(pd.concat(seasons, ignore_index=True))
+
+def action_percentiles(base):
+    print(f"Compiling seasonal action percentiles for {len(base)} rows...")
+    pct = group_quantiles(base, ["data.action_type", "general_position", "season"], ["data.goals_added_raw_p96", "data.goals_added_raw"])
+    if (len(pct) == 0):
+        return pd.DataFrame()
 
-    if (action_type != None):
-        slice_gplus = slice_gplus[(slice_gplus["data.action_type"] == action_type)]
+    return pd.DataFrame({ "position" : pct["general_position"], "action_type" : pct["data.action_type"], "season" : pct["season"], "pct" : pct["pct"], "p96" : pct["data.goals_added_raw_p96"], "pSzn" : pct["data.goals_added_raw"]})
 
-    grouped_slice = slice_gplus.groupby(['season_name','player_id']).agg({
+def player_seasons(base):
+    grouped = base.groupby(['general_position','season','season_name','player_id'], observed=True).agg({
         'data.goals_added_raw': ['sum'], 
         'minutes_played' : ['mean']
     }).reset_index()
-    grouped_slice.columns = grouped_slice.columns.droplevel(level=1)
-    grouped_slice['total'] = grouped_slice['data.goals_added_raw']
-    grouped_slice['total_rank'] = grouped_slice['total'].rank(ascending = False)
-    grouped_slice['p96'] = grouped_slice['data.goals_added_raw'] * 96 / grouped_slice["minutes_played"]
-    grouped_slice['p96_rank'] = grouped_slice['p96'].rank(ascending = False)
-
-    grouped_slice['team_id'] = team if (team != None) else 'All'
-    grouped_slice['position'] = position if (position != None) else 'All'
-    grouped_slice['action_type'] = action_type if (action_type != None) else 'All'
-    if (len(slice_gplus) == 0):
-        # print(f"no data for Combo of {position} / {action_type}")
-        return [
-            pd.DataFrame(),
-            pd.DataFrame()
-        ]
-
-    return [
-        grouped_slice.sort_values(by=['total_rank'], ascending=True).head(10),
-        grouped_slice.sort_values(by=['p96_rank'], ascending=True).head(10)
-    ]
+    grouped.columns = grouped.columns.droplevel(level=1)
+    grouped['total'] = grouped['data.goals_added_raw']
+    grouped['p96'] = grouped['data.goals_added_raw'] * 96 / grouped["minutes_played"]
+    return grouped
+
+def total_percentiles(base):
+    grouped = player_seasons(base)
+
+    print(f"Compiling seasonal player percentiles for {len(grouped)} player seasons...")
+    # keep the position/season ordering of the source rows rather than the groupby's sorted order
+    order = { "general_position" : base.general_position.unique(), "season" : base.season.unique() }
+    pct = group_quantiles(grouped, ["general_position", "season"], ["p96", "total"], order=order)
+    if (len(pct) == 0):
+        return pd.DataFrame()
 
-def process_competition(competition, start_year, end_year):
-    print(f"Retriving fresh G+ data from ASA for competition {competition}...") 
-    gplus_expl_flat = retrieve_data(competition, start_year, end_year, False, True)
-    gplus_expl_flat["data.goals_added_raw_p96"] =  gplus_expl_flat["data.goals_added_raw"] * 96 / gplus_expl_flat["minutes_played"]
-
-    print(f"Found {len(gplus_expl_flat)} total rows from ASA, parsing...") 
-    years = gplus_expl_flat["season"].unique().tolist()
-    print(f"Found {len(years)} unique seasons in data set: {years}")
-    action_types = gplus_expl_flat["data.action_type"].unique().tolist()
-    print(f"Found {len(action_types)} unique action types in data set: {action_types}")
-    positions = gplus_expl_flat["general_position"].unique().tolist()
-    print(f"Found {len(positions)} unique positions in data set: {positions}")
-    teams = gplus_expl_flat["team_id"].unique().tolist()
-    print(f"Found {len(teams)} unique teams in data set: {teams}")
-
-    print(f"Generating seasonal composites...") 
-    percentile_composite = pd.DataFrame()
-    for t in action_types:
-        for p in positions:
-            for y in years:
-                df = action_percentiles(gplus_expl_flat, p, t, y)
-                percentile_composite = pd.concat([percentile_composite, df], ignore_index=True)
-
-    print(f"Creating competition file path at ./data/{competition}")
-    base_path = f"./data/{competition}"
-    os.makedirs(base_path, exist_ok=True)
-
-    print(f"Saving {len(percentile_composite)} seasonal action percentiles to disk...")
-    percentile_composite.to_csv(f'{base_path}/season-g+-pct.csv', index=False)
-    print(f"Generated {len(percentile_composite)} seasonal action percentiles for {len(action_types)} action types, saved to disk.") 
-
-    player_composite = pd.DataFrame()
-    for p in positions:
-        for y in years:
-            df = total_percentiles(gplus_expl_flat, p, y)
-            player_composite = pd.concat([player_composite, df], ignore_index=True)
-
-    print(f"Saving {len(player_composite)} seasonal player percentiles to disk...")
-    player_composite.to_csv(f'{base_path}/player-g+-pct.csv', index=False)
-    print(f"Generated {len(player_composite)} seasonal player percentiles, saved to disk.") 
+    return pd.DataFrame({ "position" : pct["general_position"], "season" : pct["season"], "pct" : pct["pct"], "p96" : pct["p96"], "pSzn" : pct["total"]})
 
+def fetch_player_lookup(competition, gplus_expl_flat):
     print(f"Grabbing players for look-up table...") 
     player_list = gplus_expl_flat[gplus_expl_flat.player_id.notna() == True].player_id.unique().tolist()
     print(f"Found {len(player_list)} players in G+ dataset, parsing...")
 
-    player_data = pd.DataFrame()
-    chunks = np.array_split(player_list, 50)
-    for i in range(0, len(chunks)):
-        time.sleep(3)
-        chunk = chunks[i]
-        id_list = ','.join(chunk)
-        print(f"Grabbing player data using ids chunk {i} of {len(chunks)}...")
-        url = f"https://app.americansocceranalysis.com/api/v1/{competition}/players?player_id={id_list}"
-        tmp = pd.read_json(url)
-        player_data = pd.concat([player_data, tmp], ignore_index=True)
-
-    print(f"Found {len(player_data)} ASA player records, dropping dupes...")
-    player_data.drop_duplicates('player_id',inplace=True)
-    player_data.sort_values(by='player_name', inplace=True)
-    print(f"Found {len(player_data)} unique ASA player records, slimming and saving to disk...")
-    slim_set = player_data[['player_id', 'player_name']]
-    slim_set.to_csv(f'{base_path}/player_lookup.csv',index=False)
-    print(f"Saved lookup table of {len(player_data)} player records to disk.")
-
-    player_ranks_total = pd.DataFrame()
-    player_ranks_p96 = pd.DataFrame()
-
-    no_gk_rank_df = gplus_expl_flat[gplus_expl_flat.general_position != 'GK']
-
-    for year in years:
-        # rank within league WITHOUT GK
-        [df_total, df_p96] = rank_players(no_gk_rank_df, year, None, None, None)
-        player_ranks_total = pd.concat([player_ranks_total, df_total], ignore_index=True)
-        player_ranks_p96 = pd.concat([player_ranks_p96, df_p96], ignore_index=True)
-
-        # rank within position WITH GK
-        for pos in positions:
-            [df_total, df_p96] = rank_players(gplus_expl_flat, year, None, pos, None)
-            player_ranks_total = pd.concat([player_ranks_total, df_total], ignore_index=True)
-            player_ranks_p96 = pd.concat([player_ranks_p96, df_p96], ignore_index=True)
-
-        # rank in action type
-        for action_type in action_types:
-            [df_total, df_p96] = rank_players(gplus_expl_flat, year, None, None, action_type)
-            player_ranks_total = pd.concat([player_ranks_total, df_total], ignore_index=True)
-            player_ranks_p96 = pd.concat([player_ranks_p96, df_p96], ignore_index=True)
-            # rank in action_type at position
-            for pos in positions:
-                [df_total, df_p96] = rank_players(gplus_expl_flat, year, None, pos, action_type)
-                player_ranks_total = pd.concat([player_ranks_total, df_total], ignore_index=True)
-                player_ranks_p96 = pd.concat([player_ranks_p96, df_p96], ignore_index=True)
-
-        # for each team
-        for team in teams:
-            # rank within action type WITH GK
-            for action_type in action_types:
-                [df_total, df_p96] = rank_players(gplus_expl_flat, year, team, None, action_type)
-                player_ranks_total = pd.concat([player_ranks_total, df_total], ignore_index=True)
-                player_ranks_p96 = pd.concat([player_ranks_p96, df_p96], ignore_index=True)
-
-                # rank in action_type at position
-                for pos in positions:
-                    [df_total, df_p96] = rank_players(gplus_expl_flat, year, team, pos, action_type)
-                    player_ranks_total = pd.concat([player_ranks_total, df_total], ignore_index=True)
-                    player_ranks_p96 = pd.concat([player_ranks_p96, df_p96], ignore_index=True)
-
-            # rank within position WITH GK
-            for pos in positions:
-                [df_total, df_p96] = rank_players(gplus_expl_flat, year, team, pos, None)
-                player_ranks_total = pd.concat([player_ranks_total, df_total], ignore_index=True)
-                player_ranks_p96 = pd.concat([player_ranks_p96, df_p96], ignore_index=True)
-            # rank within team WITHOUT GK
-            [df_total, df_p96] = rank_players(no_gk_rank_df, year, team, None, None)
-            player_ranks_total = pd.concat([player_ranks_total, df_total], ignore_index=True)
-            player_ranks_p96 = pd.concat([player_ranks_p96, df_p96], ignore_index=True)
-
-
-    player_ranks_p96['rank_type'] = 'p96'
-    player_ranks_total['rank_type'] = 'total'
-    rank_composite = pd.concat([player_ranks_p96, player_ranks_total], ignore_index=True)
-
-    print(rank_composite.dtypes)
-    print(slim_set.dtypes)
-
-    slim_set.player_id = slim_set.player_id.astype(str)
-    rank_composite.player_id = rank_composite.player_id.astype(str)
-
-    named_composite = rank_composite.merge(slim_set, on=["player_id"])
-
-    print(f"Saving {len(named_composite)} player ranks to disk...")
-    named_composite["season_name"] = named_composite["season_name"].astype(str)
-    named_composite["season_name"] = named_composite["season_name"].str.replace(".0", "")
-    named_composite.to_csv(f'{base_path}/player-g+-ranks.csv', index=False)
-    print(f"Generated {len(named_composite)} player ranks, saved to disk.") 
-
-
-    print(f"Starting to process {len(gplus_expl_flat)} records for team roster breakdowns...")
-    grouped_gplus = gplus_expl_flat.groupby(['season_name','team_id','player_id','general_position']).agg({
-        'data.goals_added_raw': ['sum'], 
-        'minutes_played' : ['mean']
-    }).reset_index()
-    grouped_gplus.columns = grouped_gplus.columns.droplevel(level=1)
-    grouped_gplus['total'] = grouped_gplus['data.goals_added_raw']
-    grouped_gplus['p96'] = grouped_gplus['data.goals_added_raw'] * 96 / grouped_gplus["minutes_played"]
-    grouped_gplus = grouped_gplus[['season_name', 'team_id', 'player_id','general_position', 'minutes_played','total', 'p96']]
-    print(f"Found {len(grouped_gplus)} unique season/team/player/position groups...")
-
-    print(f"Organizing players by season/team/position...")
-    team_breakdown_gplus = grouped_gplus.groupby(['season_name','team_id','general_position']).apply(
-            lambda x: pd.Series([
-                np.mean(x['total']),
-                np.mean(x['p96']),
-                np.average(x['p96'], weights=(x['minutes_played'] / sum(x['minutes_played'])))
-            ], index=['total_avg', 'p96_avg', 'p96_weighted_avg'])
-        ).reset_index()
-    print(f"Calculated G+ averages for {len(team_breakdown_gplus)} season/team/position")
-    print(f"Calculating G+ ranks for {len(team_breakdown_gplus)} season/team/positions...")
-    team_breakdown_gplus['total_avg_rank'] = team_breakdown_gplus.groupby(['season_name','general_position'])['total_avg'].rank(ascending=False)
-    team_breakdown_gplus['p96_avg_rank'] = team_breakdown_gplus.groupby(['season_name','general_position'])['p96_avg'].rank(ascending=False)
-    team_breakdown_gplus['p96_weighted_avg_rank'] = team_breakdown_gplus.groupby(['season_name','general_position'])['p96_weighted_avg'].rank(ascending=False)
-    print(f"Calculated G+ ranks for {len(team_breakdown_gplus)} season/team/positions.")
-    print(f"Writing team roster breakdown records to disk...")
-    team_breakdown_gplus["season_name"] = team_breakdown_gplus["season_name"].astype(str)
-    team_breakdown_gplus["season_name"] = team_breakdown_gplus["season_name"].str.replace(".0", "")
-    team_breakdown_gplus.to_csv(f'{base_path}/team_position_breakdown.csv', index=False)
-    print(f"Wrote {len(team_breakdown_gplus)} team roster breakdown records to disk.")
+    chunks = [chunk for chunk in np.array_split(player_list, 50) if len(chunk) > 0]
+    print(f"Grabbing player data using {len(chunks)} id chunks...")
+    urls = [client.url(f"{competition}/players", player_id=','.join(chunk)) for chunk in chunks]
+    return pd.concat(client.fetch_all(urls), ignore_index=True)
+
+def fetch_competition(competition, start_year, end_year, full_refresh = False, stale = []):
+    # everything that talks to ASA, so it can stay on the main process while compute runs elsewhere
+    print(f"Retriving G+ data from ASA for competition {competition}...") 
+    gplus_expl_flat = load_competition(competition, start_year, end_year, full_refresh, stale)
+    player_data = fetch_player_lookup(competition, gplus_expl_flat)
+    return [gplus_expl_flat, player_data]
+
+def compute_competition(competition, gplus_expl_flat, player_data, sketch_error = None):
+    with span("compute", competition=competition) as compute_span:
+        compute_span["rows"] = len(gplus_expl_flat)
+        gplus_expl_flat["data.goals_added_raw_p96"] =  gplus_expl_flat["data.goals_added_raw"] * 96 / gplus_expl_flat["minutes_played"]
+
+        print(f"Found {len(gplus_expl_flat)} total rows from ASA, parsing...") 
+        years = gplus_expl_flat["season"].unique().tolist()
+        action_types = gplus_expl_flat["data.action_type"].unique().tolist()
+        positions = gplus_expl_flat["general_position"].unique().tolist()
+        teams = gplus_expl_flat["team_id"].unique().tolist()
+        print(f"Found {len(years)} seasons ({years}), {len(action_types)} action types, {len(positions)} positions and {len(teams)} teams in data set")
+
+        base_path = f"./data/{competition}"
+        os.makedirs(base_path, exist_ok=True)
+
+        with span("action percentiles", competition=competition) as s:
+            percentile_composite = action_percentiles(gplus_expl_flat)
+            s["rows"] = len(percentile_composite)
+        write_outputs(percentile_composite, f'{base_path}/season-g+-pct.csv', 'season-g+-pct', competition, 'season')
+        print(f"Generated {len(percentile_composite)} seasonal action percentiles for {len(action_types)} action types, saved to disk.") 
+
+        with span("player percentiles", competition=competition) as s:
+            player_composite = total_percentiles(gplus_expl_flat)
+            s["rows"] = len(player_composite)
+        write_outputs(player_composite, f'{base_path}/player-g+-pct.csv', 'player-g+-pct', competition, 'season')
+        print(f"Generated {len(player_composite)} seasonal player percentiles, saved to disk.") 
+
+        player_data.drop_duplicates('player_id',inplace=True)
+        player_data.sort_values(by='player_name', inplace=True)
+        slim_set = player_data[['player_id', 'player_name']]
+        write_outputs(slim_set, f'{base_path}/player_lookup.csv', 'player_lookup', competition)
+        print(f"Saved lookup table of {len(player_data)} unique player records to disk.")
+
+        with span("ranks", competition=competition) as s:
+            rank_index = build_rank_index(gplus_expl_flat, years, teams, positions, action_types)
+            save_rank_index(rank_index, competition)
+            [player_ranks_total, player_ranks_p96] = rank_index.top()
+
+            player_ranks_p96['rank_type'] = 'p96'
+            player_ranks_total['rank_type'] = 'total'
+            rank_composite = pd.concat([player_ranks_p96, player_ranks_total], ignore_index=True)
+
+            slim_set.player_id = slim_set.player_id.astype(str)
+            rank_composite.player_id = rank_composite.player_id.astype(str)
+
+            named_composite = rank_composite.merge(slim_set, on=["player_id"])
+            named_composite["season_name"] = named_composite["season_name"].astype(str)
+            named_composite["season_name"] = named_composite["season_name"].str.replace(".0", "")
+            s["rows"] = len(named_composite)
+        with span("write", table="ranks", competition=competition) as s:
+            s["rows"] = write_ranks(named_composite, slim_set, base_path)
+        if ranks_csv:
+            write_outputs(named_composite, f'{base_path}/player-g+-ranks.csv', 'player-g+-ranks', competition, 'season_name')
+        print(f"Generated {len(named_composite)} player ranks, saved to disk.") 
+
+        with span("team breakdown", competition=competition) as s:
+            team_breakdown_gplus = team_breakdown(gplus_expl_flat)
+            s["rows"] = len(team_breakdown_gplus)
+        write_outputs(team_breakdown_gplus, f'{base_path}/team_position_breakdown.csv', 'team_position_breakdown', competition, 'season_name')
+        print(f"Wrote {len(team_breakdown_gplus)} team roster breakdown records to disk.")
+
+        with span("similarity", competition=competition) as s:
+            profiles = player_profiles(gplus_expl_flat, competition)
+            save_profiles(profiles, competition)
+            similar_players = SimilarityIndex(profiles).neighbour_table()
+            s["rows"] = len(similar_players)
+        write_outputs(similar_players, f'{base_path}/similar-players.csv', 'similar-players', competition, 'season_name')
+        print(f"Wrote the nearest player-seasons of {len(profiles)} player-season profiles to disk.")
+
+        if sketch_error:
+            with span("sketches", competition=competition):
+                store_sketches(competition, gplus_expl_flat, sketch_error)
+
+def store_sketches(competition, base, sketch_error):
+    # mergeable per-season sketches, sketches.py builds career/multi-season percentiles from these without the raw rows
+    compression = compression_for(sketch_error)
+    action = build_sketches(base, ["season", "general_position", "data.action_type"], ["data.goals_added_raw_p96", "data.goals_added_raw"], compression)
+    player = build_sketches(player_seasons(base), ["season", "general_position"], ["p96", "total"], compression)
+    save_sketches({ "action" : action, "player" : player }, competition)
+    print(f"Stored {len(action)} action and {len(player)} player sketches for {competition} (compression {compression})")
+
+def process_competition(competition, start_year, end_year, full_refresh = False, stale = [], sketch_error = None):
+    [gplus_expl_flat, player_data] = fetch_competition(competition, start_year, end_year, full_refresh, stale)
+    compute_competition(competition, gplus_expl_flat, player_data, sketch_error)
 
 competitions = [
     {
@@ -317,5 +262,34 @@ competitions = [
         "end_year": next_year
     }
 ]
-for c in competitions:
-    process_competition(c["competition"], c["start_year"], c["end_year"])
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh G+ percentiles, ranks and team breakdowns from ASA")
+    parser.add_argument("--full-refresh", action="store_true", help="re-pull every season instead of only open/stale ones")
+    parser.add_argument("--workers", type=int, default=1, help="compute competitions on a pool of this many processes while the next one is fetched")
+    parser.add_argument("--stale", action="append", default=[], metavar="COMPETITION:SEASON", help="force a re-pull of a closed season, e.g. mls:2023")
+    parser.add_argument("--report", metavar="PATH", help="write a JSON report of per-stage timings, memory and request counts")
+    parser.add_argument("--sketches", type=float, nargs="?", const=default_error, metavar="ERROR", help=f"also store mergeable quantile sketches for career percentiles, with this rank error (default {default_error})")
+    args = parser.parse_args()
+    if args.report:
+        instrument.start_memory_tracing()
+
+    stale = {}
+    for item in args.stale:
+        comp, yr = item.split(":")
+        stale.setdefault(comp, []).append(int(yr))
+
+    if args.workers <= 1:
+        for c in competitions:
+            process_competition(c["competition"], c["start_year"], c["end_year"], args.full_refresh, stale.get(c["competition"], []), args.sketches)
+    else:
+        # only this process talks to ASA: competitions are fetched one at a time here and handed off to the pool once their data is in
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            jobs = []
+            for c in competitions:
+                [gplus_expl_flat, player_data] = fetch_competition(c["competition"], c["start_year"], c["end_year"], args.full_refresh, stale.get(c["competition"], []))
+                jobs.append(pool.submit(instrument.collect, instrument.tracing(), compute_competition, c["competition"], gplus_expl_flat, player_data, args.sketches))
+            for job in jobs:
+                instrument.record(job.result()[1])
+
+    if args.report:
+        instrument.write_report(args.report, "asa_retrieve.py", vars(args))
@@ -0,0 +1,89 @@
+import zlib
+import numpy as np
+import pandas as pd
+
+# synthetic goals-added payloads shaped like ASA's responses, so the pipeline can be benchmarked without the API
+field_actions = ["Dribbling", "Fouling", "Interrupting", "Passing", "Receiving", "Shooting"]
+gk_actions = ["Claiming", "Fielding", "Handling", "Passing", "Shotstopping", "Sweeping"]
+zone_actions = ["Dribbling", "Fouling", "Interrupting", "Passing", "Receiving", "Shooting", "Claiming"]
+positions = ["CB", "FB", "DM", "CM", "AM", "W", "ST"]
+competition_names = ["mls", "nwsl", "usls", "uslc", "usl1", "mlsnp"]
+
+def player_id(competition, i):
+    return f"{competition}p{i:05d}"
+
+def team_id(competition, t):
+    return f"{competition}t{t:03d}"
+
+def action_data(rng, actions, scale = 1.0):
+    raw = np.round(rng.normal(0.3, 1.2, len(actions)) * scale, 4)
+    above = np.round(rng.normal(0.0, 1.0, len(actions)) * scale, 4)
+    counts = rng.integers(0, 900, len(actions))
+    return [{ "action_type" : a, "goals_added_raw" : float(raw[k]), "goals_added_above_avg" : float(above[k]), "count_actions" : int(counts[k]) } for k, a in enumerate(actions)]
+
+def minutes(rng, season_minutes):
+    # mostly spread out, with some bench players and a few ever-presents like a real roster
+    if rng.random() < 0.15:
+        return int(rng.choice([0, 45, 90, 500]))
+    return int(rng.integers(1, season_minutes))
+
+def season_players(competition, yr, teams = 20, roster = 25, gk = False, transfer_rate = 0.05, seed = 0):
+    # players/goals-added (or goalkeepers/goals-added) for one season, split by team
+    rng = np.random.default_rng([seed, zlib.crc32(competition.encode()), yr, int(gk)])
+    season_minutes = 34 * 96
+    records = []
+    for t in range(teams):
+        for j in range(3 if gk else roster):
+            # players mostly stay put from season to season, shifted a little so rosters turn over
+            i = 50000 + t * 10 + j if gk else t * 1000 + j + (yr % 5)
+            record = { "player_id" : player_id(competition, i), "team_id" : team_id(competition, t), "minutes_played" : minutes(rng, season_minutes), "season_name" : str(yr) }
+            if not gk:
+                record["general_position"] = positions[i % len(positions)]
+            record["data"] = action_data(rng, gk_actions if gk else field_actions)
+            records.append(record)
+            if not gk and rng.random() < transfer_rate:
+                # a mid-season move shows up as a second record for the same player on another team
+                moved = dict(record, team_id=team_id(competition, (t + 1) % teams), minutes_played=minutes(rng, season_minutes // 2), data=action_data(rng, field_actions))
+                records.append(moved)
+    return records
+
+def player_lookup(records):
+    # players?player_id= rows for every id in the payloads
+    ids = pd.unique(pd.Series([r["player_id"] for r in records]))
+    return pd.DataFrame({ "player_id" : ids, "player_name" : [f"Player {i}" for i in ids], "birth_date" : "1990-01-01" })
+
+def zone_season(competition, yr, teams = 20, seed = 0, zones = range(1, 31), game_states = range(-2, 3)):
+    # teams/goals-added for every zone/game state of one season, concatenated like zones_retrieve.fetch_season returns it
+    rng = np.random.default_rng([seed, zlib.crc32(competition.encode()), yr, 7])
+    rows = []
+    for z in zones:
+        for g in game_states:
+            for t in range(teams):
+                # not every team records an action in every zone/game state
+                if rng.random() < 0.05:
+                    continue
+                data = [{
+                    "action_type" : a,
+                    "num_actions_for" : int(rng.integers(0, 100)),
+                    "goals_added_for" : float(np.round(rng.normal(0, 0.3), 4)),
+                    "num_actions_against" : int(rng.integers(0, 100)),
+                    "goals_added_against" : float(np.round(rng.normal(0, 0.3), 4))
+                } for a in zone_actions]
+                rows.append({ "team_id" : team_id(competition, t), "minutes" : int(rng.integers(10, 3000)), "data" : data, "zone" : z, "season_name" : yr, "game_state" : g })
+    return pd.DataFrame(rows)
+
+def generate(competitions = 2, seasons = 3, teams = 20, roster = 25, start_year = 2020, seed = 0):
+    # { competition : { season : (player records, goalkeeper records) } }, plus each competition's player lookup
+    payloads = {}
+    lookups = {}
+    for c in range(competitions):
+        competition = competition_names[c] if c < len(competition_names) else f"comp{c}"
+        payloads[competition] = {}
+        everyone = []
+        for yr in range(start_year, start_year + seasons):
+            records = season_players(competition, yr, teams, roster, False, seed=seed)
+            gk_records = season_players(competition, yr, teams, roster, True, seed=seed)
+            payloads[competition][yr] = (records, gk_records)
+            everyone += records + gk_records
+        lookups[competition] = player_lookup(everyone)
+    return payloads, lookups
@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import tracemalloc
+import argparse
+import datetime
+import platform
+import subprocess
+import tempfile
+import shutil
+import io
+import contextlib
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_root = os.path.dirname(bench_dir)
+sys.path.insert(0, repo_root)
+
+import pandas as pd
+
+import instrument
+import asa_retrieve
+import zones_retrieve
+from gplus_schema import apply_schema
+from payloads import generate, zone_season
+
+history_path = os.path.join(bench_dir, "history.jsonl")
+
+def run_pipeline(payloads, lookups, zone_payloads):
+    # the same stage functions the refresh scripts run, fed from memory instead of ASA
+    for competition, seasons in payloads.items():
+        frames = []
+        for yr, (records, gk_records) in seasons.items():
+            with instrument.span("explode", competition=competition, season=yr) as s:
+                frames.append(asa_retrieve.explode_season(competition, yr, records, gk_records))
+                s["rows"] = len(frames[-1])
+        base = apply_schema(pd.concat(frames, ignore_index=True))
+        asa_retrieve.compute_competition(competition, base, lookups[competition].copy())
+
+    stripped = pd.concat([zones_retrieve.process_season("mls", yr, frame.copy()) for yr, frame in zone_payloads.items()], ignore_index=True)
+    zones_retrieve.compute_competition("mls", stripped)
+
+def stage_key(record):
+    return f"write {record['table']}" if record["name"] == "write" else record["name"]
+
+def stage_totals(records):
+    # one entry per stage, summed over competitions/seasons
+    totals = {}
+    for r in records:
+        t = totals.setdefault(stage_key(r), { "wall_s" : 0.0, "cpu_s" : 0.0, "rows" : 0, "peak_mb" : None })
+        t["wall_s"] += r["wall_s"]
+        t["cpu_s"] += r["cpu_s"]
+        t["rows"] += r["rows"] or 0
+        if r["peak_mb"] is not None:
+            t["peak_mb"] = max(t["peak_mb"] or 0, r["peak_mb"])
+    return totals
+
+def clear_outputs(workdir):
+    # publish_csv skips tables that match its manifest, so every pass starts from an empty workdir and times the real writes
+    for name in os.listdir(workdir):
+        path = os.path.join(workdir, name)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+def quiet_pipeline(payloads, lookups, zone_payloads, verbose = False):
+    # the stages' progress prints would drown out the results table
+    clear_outputs(os.getcwd())
+    with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+        run_pipeline(payloads, lookups, zone_payloads)
+
+def measure(payloads, lookups, zone_payloads, repeat, verbose = False):
+    # best-of-n timings without tracemalloc (it distorts them), then one traced pass for peak memory
+    stages = {}
+    for _ in range(repeat):
+        instrument.spans.clear()
+        quiet_pipeline(payloads, lookups, zone_payloads, verbose)
+        for key, t in stage_totals(instrument.spans).items():
+            if key not in stages or t["wall_s"] < stages[key]["wall_s"]:
+                stages[key] = t
+
+    instrument.spans.clear()
+    instrument.trace_memory = True
+    instrument.start_memory_tracing()
+    quiet_pipeline(payloads, lookups, zone_payloads, verbose)
+    tracemalloc.stop()
+    for key, t in stage_totals(instrument.spans).items():
+        stages[key]["peak_mb"] = t["peak_mb"]
+
+    for t in stages.values():
+        t["wall_s"] = round(t["wall_s"], 4)
+        t["cpu_s"] = round(t["cpu_s"], 4)
+        t["rows_per_s"] = round(t["rows"] / t["wall_s"], 1) if t["wall_s"] > 0 else None
+    return stages
+
+def load_history(params, host):
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    return [e for e in entries if e["params"] == params and e["host"] == host]
+
+def find_regressions(stages, history, threshold, noise_s = 0.01):
+    # compare against the best run on record for the same payload size on this machine
+    regressions = []
+    for key, t in stages.items():
+        previous = [e["stages"][key] for e in history if key in e["stages"]]
+        if len(previous) == 0:
+            continue
+        best_wall = min(p["wall_s"] for p in previous)
+        if t["wall_s"] > best_wall * (1 + threshold) and t["wall_s"] - best_wall > noise_s:
+            regressions.append(f"{key}: {t['wall_s']:.3f}s wall vs best {best_wall:.3f}s")
+        peaks = [p["peak_mb"] for p in previous if p.get("peak_mb") is not None]
+        if t["peak_mb"] is not None and len(peaks) > 0 and t["peak_mb"] > min(peaks) * (1 + threshold):
+            regressions.append(f"{key}: {t['peak_mb']:.2f} MB peak vs best {min(peaks):.2f} MB")
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo_root, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the G+ pipeline stages on synthetic ASA payloads, no network needed")
+    parser.add_argument("--competitions", type=int, default=2)
+    parser.add_argument("--seasons", type=int, default=3)
+    parser.add_argument("--teams", type=int, default=20)
+    parser.add_argument("--roster", type=int, default=25)
+    parser.add_argument("--zone-seasons", type=int, default=None, help="seasons of team zone payloads (defaults to --seasons)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage, the fastest is kept")
+    parser.add_argument("--threshold", type=float, default=0.25, help="fail when a stage is this much slower (or bigger) than its best recorded run")
+    parser.add_argument("--verbose", action="store_true", help="show the stages' own progress output")
+    parser.add_argument("--no-record", action="store_true", help="don't append this run to bench/history.jsonl")
+    args = parser.parse_args()
+
+    params = { "competitions" : args.competitions, "seasons" : args.seasons, "teams" : args.teams, "roster" : args.roster, "zone_seasons" : args.zone_seasons or args.seasons, "seed" : args.seed }
+    print(f"Generating synthetic payloads for {params}...")
+    payloads, lookups = generate(args.competitions, args.seasons, args.teams, args.roster, seed=args.seed)
+    zone_payloads = { 2020 + i : zone_season("mls", 2020 + i, args.teams, seed=args.seed) for i in range(params["zone_seasons"]) }
+
+    # compute_competition writes its CSVs under ./data, keep those out of the repo
+    instrument.trace_memory = False
+    workdir = tempfile.mkdtemp(prefix="gplus-bench-")
+    os.chdir(workdir)
+    stages = measure(payloads, lookups, zone_payloads, args.repeat, args.verbose)
+
+    host = platform.node()
+    history = load_history(params, host)
+    regressions = find_regressions(stages, history, args.threshold)
+
+    print(f"{'stage':<34}{'wall s':>10}{'cpu s':>10}{'rows':>10}{'rows/s':>14}{'peak MB':>10}")
+    for key, t in sorted(stages.items(), key=lambda kv: -kv[1]["wall_s"]):
+        print(f"{key:<34}{t['wall_s']:>10.3f}{t['cpu_s']:>10.3f}{t['rows']:>10}{t['rows_per_s'] or 0:>14.1f}{t['peak_mb'] if t['peak_mb'] is not None else '-':>10}")
+
+    if not args.no_record:
+        entry = {
+            "recorded_at" : datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit" : git_commit(),
+            "host" : host,
+            "python" : platform.python_version(),
+            "pandas" : pd.__version__,
+            "params" : params,
+            "repeat" : args.repeat,
+            "stages" : stages
+        }
+        with open(history_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        print(f"Appended run to {history_path} ({len(history) + 1} runs on record for these params on {host})")
+
+    if len(regressions) > 0:
+        print(f"{len(regressions)} stage(s) regressed by more than {args.threshold:.0%}:")
+        for r in regressions:
+            print(f"  {r}")
+        sys.exit(1)
+    print(f"No stage regressed by more than {args.threshold:.0%} against {len(history)} earlier runs.")
@@ -0,0 +1,66 @@
+import pandas as pd
+import numpy as np
+
+def group_layout(ids, ngroups):
+    # rows ordered by group (keeping their order within each group), plus where each group starts and how long it is
+    order = np.argsort(ids, kind="stable")
+    counts = np.bincount(ids, minlength=ngroups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+    return order, starts, counts
+
+def group_sums(values, starts):
+    # plain per group sums over the group-ordered values; these can differ from the old per-group np.mean/np.average in the last bit
+    if len(starts) == 0:
+        return np.zeros(0)
+    return np.add.reduceat(values, starts)
+
+def player_totals(base, keys):
+    grouped = base.groupby(keys, observed=True).agg({
+        'data.goals_added_raw': ['sum'],
+        'minutes_played' : ['mean']
+    }).reset_index()
+    grouped.columns = grouped.columns.droplevel(level=1)
+    grouped['total'] = grouped['data.goals_added_raw']
+    grouped['p96'] = grouped['data.goals_added_raw'] * 96 / grouped["minutes_played"]
+    return grouped[keys + ['minutes_played','total', 'p96']]
+
+def grouped_averages(players, team_keys):
+    # total_avg, p96_avg and p96_weighted_avg per team group from one stable layout
+    teams = players.groupby(team_keys, observed=True)
+    ids = teams.ngroup().to_numpy()
+    breakdown = teams.size().reset_index()[team_keys]
+    order, starts, counts = group_layout(ids, len(breakdown))
+    total = players['total'].to_numpy(dtype=np.float64)[order]
+    p96 = players['p96'].to_numpy(dtype=np.float64)[order]
+    minutes = players['minutes_played'].to_numpy(dtype=np.float64)[order]
+
+    # np.mean on a Series is pandas' mean, which skips NaN (e.g. 0/0 p96 for 0 minute players)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for column, values in [('total_avg', total), ('p96_avg', p96)]:
+            present = ~np.isnan(values)
+            breakdown[column] = group_sums(np.where(present, values, 0.0), starts) / np.bincount(ids[order], weights=present, minlength=len(breakdown))
+
+        # np.average(p96, weights=minutes / sum(minutes)), where NaN does propagate
+        weights = minutes / np.repeat(group_sums(minutes, starts), counts)
+        breakdown['p96_weighted_avg'] = group_sums(p96 * weights, starts) / group_sums(weights, starts)
+
+    return breakdown
+
+def team_breakdown(base, extra_dims = []):
+    # per season/team/position (and any extra dims, e.g. data.action_type): the plain and minutes-weighted averages of each player's G+
+    player_keys = ['season_name','team_id','player_id','general_position'] + extra_dims
+    team_keys = ['season_name','team_id','general_position'] + extra_dims
+    rank_keys = ['season_name','general_position'] + extra_dims
+
+    print(f"Starting to process {len(base)} records for team roster breakdowns...")
+    players = player_totals(base, player_keys)
+
+    print(f"Organizing {len(players)} season/team/player/position groups by {'/'.join(team_keys)}...")
+    breakdown = grouped_averages(players, team_keys)
+
+    print(f"Calculating G+ ranks for {len(breakdown)} {'/'.join(team_keys)} groups...")
+    for column in ['total_avg', 'p96_avg', 'p96_weighted_avg']:
+        breakdown[f'{column}_rank'] = breakdown.groupby(rank_keys, observed=True)[column].rank(ascending=False)
+    breakdown["season_name"] = breakdown["season_name"].astype(str)
+    breakdown["season_name"] = breakdown["season_name"].str.replace(".0", "")
+    return breakdown
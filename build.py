@@ -0,0 +1,280 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import datetime
+import fnmatch
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import instrument
+import asa_api
+from instrument import span
+import asa_retrieve
+import zones_retrieve
+import game_form
+import sketches
+import player_lookup
+import team_lookup
+from asa_retrieve import competitions
+from zone_tensor import output_dir, tensor_path, axes_path
+from sketches import default_error, sketch_path
+from similarity import profile_path
+from leaderboards import rank_index_path
+
+# fingerprints and output hashes of the last successful build of every task
+state_path = "./snapshots/build_state.json"
+# token bucket the parallel workers share, so --jobs N doesn't multiply the request rate against ASA
+rate_path = "./snapshots/asa_rate.json"
+
+class Task:
+    # one node of the build graph: `action` is (function, args) so it can be shipped to a worker process
+    def __init__(self, name, action, outputs, deps = [], inputs = [], code = [], remote = False):
+        self.name = name
+        self.stage, _, self.competition = name.partition(":")
+        self.action = action
+        self.outputs = outputs
+        self.deps = deps
+        self.inputs = inputs
+        self.code = code
+        # remote tasks read from ASA, nothing local says whether they're stale so they go by age
+        self.remote = remote
+
+    def matches(self, pattern):
+        # a task name (glob), a stage (gplus) or a competition (mls)
+        return fnmatch.fnmatch(self.name, pattern) or pattern in [self.stage, self.competition]
+
+def run_gplus(competition, start_year, end_year, full_refresh, sketch_error):
+    asa_retrieve.process_competition(competition, start_year, end_year, full_refresh, [], sketch_error)
+
+def run_zones(competition, sketch_error):
+    zones_retrieve.run(1, sketch_error, [competition])
+
+def run_form(competition, start_year, end_year, full_refresh):
+    game_form.process_competition(competition, start_year, end_year, full_refresh=full_refresh)
+
+def run_windows(competition):
+    sketches.write_windows(competition, None)
+    sketches.write_zone_windows(competition, None)
+
+def run_player_lookup():
+    player_lookup.main()
+
+def run_team_lookup():
+    team_lookup.main()
+
+def build_graph(full_refresh = False, sketch_error = default_error):
+    gplus_code = ["asa_retrieve.py", "asa_api.py", "gplus_schema.py", "percentiles.py", "leaderboards.py", "breakdown.py", "ranks_store.py", "similarity.py", "sketches.py", "parquet_store.py"]
+    tasks = []
+    for c in competitions:
+        comp = c["competition"]
+        base_path = f"./data/{comp}"
+        zone_path = output_dir(comp)
+        tasks.append(Task(f"gplus:{comp}", (run_gplus, (comp, c["start_year"], c["end_year"], full_refresh, sketch_error)),
+            outputs=[f"{base_path}/{f}" for f in ["season-g+-pct.csv", "player-g+-pct.csv", "player_lookup.csv", "player-g+-ranks.csv", "team_position_breakdown.csv", "similar-players.csv", "ranks/boards.csv", "ranks/ranks.npy"]] + [sketch_path(comp), profile_path(comp), rank_index_path(comp)],
+            code=gplus_code, remote=True))
+        tasks.append(Task(f"zones:{comp}", (run_zones, (comp, sketch_error)),
+            outputs=[f"{zone_path}/team-g+-zones.csv", f"{zone_path}/percentile-g+-zones.csv", tensor_path(comp), axes_path(comp), sketch_path(f"{comp}-zones")],
+            code=["zones_retrieve.py", "zone_tensor.py", "percentiles.py", "sketches.py", "parquet_store.py"], remote=True))
+        tasks.append(Task(f"form:{comp}", (run_form, (comp, c["start_year"], c["end_year"], full_refresh)),
+            outputs=[f"{base_path}/{f}" for f in ["game-g+-pct.csv", "form-g+-pct.csv", "form-g+-ranks.csv"]],
+            code=["game_form.py", "gplus_schema.py", "percentiles.py", "parquet_store.py"], remote=True))
+        tasks.append(Task(f"windows:{comp}", (run_windows, (comp,)),
+            outputs=[f"{base_path}/career-g+-pct.csv", f"{base_path}/career-player-g+-pct.csv", f"{zone_path}/career-g+-zones.csv"],
+            deps=[f"gplus:{comp}", f"zones:{comp}"], inputs=[sketch_path(comp), sketch_path(f"{comp}-zones")],
+            code=["sketches.py", "percentiles.py", "parquet_store.py"]))
+
+    names = [f"./data/{c['competition']}/player_lookup.csv" for c in competitions]
+    ranks = [f"./data/{c['competition']}/{f}" for c in competitions for f in ["player-g+-ranks.csv", "ranks/boards.csv", "ranks/ranks.npy"]]
+    tasks.append(Task("player_lookup", (run_player_lookup, ()),
+        outputs=["./data/player_lookup.csv", "./data/player_membership.csv", "./data/player_membership_resolved.csv"],
+        deps=[f"gplus:{c['competition']}" for c in competitions], inputs=ranks + names,
+        code=["player_lookup.py", "membership_index.py", "ranks_store.py", "asa_api.py"]))
+    tasks.append(Task("team_lookup", (run_team_lookup, ()),
+        outputs=["./data/team_lookup.csv"],
+        deps=["player_lookup"], inputs=["./data/player_membership.csv"] + names,
+        code=["team_lookup.py", "membership_index.py"]))
+    return { t.name : t for t in tasks }
+
+def file_hash(path):
+    if not os.path.exists(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def fingerprint(task):
+    # what the task's outputs are a function of: its parameters, its code and the contents of its inputs
+    repo_root = os.path.dirname(os.path.abspath(__file__))
+    payload = {
+        "params" : [repr(a) for a in task.action[1]],
+        "code" : { f : file_hash(os.path.join(repo_root, f)) for f in task.code },
+        "inputs" : { f : file_hash(f) for f in task.inputs },
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+def load_state(path = state_path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(state, path = state_path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def stale_reason(task, state, max_age_hours):
+    # why the task needs to run, or None when its recorded build still holds
+    entry = state.get(task.name)
+    if entry is None:
+        return "never built"
+    for path, digest in entry["outputs"].items():
+        if file_hash(path) != digest:
+            return f"{path} changed or missing"
+    if task.remote:
+        age = (time.time() - entry["built_at"]) / 3600
+        return f"remote data is {age:.1f}h old" if age >= max_age_hours else None
+    if entry["fingerprint"] != fingerprint(task):
+        return "inputs, code or parameters changed"
+    return None
+
+def select(graph, targets, only = False):
+    # the targeted tasks plus (unless only) everything they depend on, in graph order
+    chosen = set()
+    pending = [name for name, t in graph.items() if not targets or any(t.matches(p) for p in targets)]
+    if targets and len(pending) == 0:
+        raise SystemExit(f"no task matches {targets}, see --list")
+    while pending:
+        name = pending.pop()
+        if name in chosen:
+            continue
+        chosen.add(name)
+        if not only:
+            pending.extend(graph[name].deps)
+    return [name for name in graph.keys() if name in chosen]
+
+def run_task(task):
+    fn, args = task.action
+    with span("task", task=task.name):
+        fn(*args)
+
+def build(graph, names, jobs = 1, force = False, max_age_hours = 0, dry_run = False):
+    # runs every stale task once its selected dependencies are done, up to `jobs` at a time; returns the names of failed tasks
+    state = load_state()
+    waiting = list(names)
+    done = set()
+    ran = set()
+    failed = []
+    running = {}
+    pool = None
+    if jobs > 1 and not dry_run:
+        asa_api.share_rate_limit(rate_path)
+        pool = ProcessPoolExecutor(max_workers=jobs)
+
+    def finished(name, error = None):
+        if error is not None:
+            print(f"[build] {name} failed: {error!r}")
+            failed.append(name)
+            return
+        if not dry_run:
+            finish(graph[name], state)
+        done.add(name)
+        ran.add(name)
+
+    while waiting or running:
+        progressed = False
+        for name in list(waiting):
+            deps = [d for d in graph[name].deps if d in names]
+            if any(d in failed for d in deps):
+                print(f"[build] skipping {name}, a dependency failed")
+                waiting.remove(name)
+                failed.append(name)
+                progressed = True
+                continue
+            if not all(d in done for d in deps) or len(running) >= jobs:
+                continue
+            waiting.remove(name)
+            progressed = True
+
+            task = graph[name]
+            reason = "forced" if force else stale_reason(task, state, max_age_hours)
+            if dry_run and reason is None and any(d in ran for d in deps):
+                # the real run would only know once the dependency has rewritten its outputs
+                reason = "dependency would rebuild, inputs may change"
+            if reason is None:
+                print(f"[build] {name} is up to date")
+                done.add(name)
+            elif dry_run:
+                print(f"[build] would build {name} ({reason})")
+                finished(name)
+            elif pool:
+                print(f"[build] building {name} ({reason})")
+                running[pool.submit(instrument.collect, instrument.tracing(), run_task, task)] = name
+            else:
+                print(f"[build] building {name} ({reason})")
+                try:
+                    run_task(task)
+                    finished(name)
+                except Exception as e:
+                    finished(name, e)
+
+        if running:
+            complete, _ = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            for future in complete:
+                name = running.pop(future)
+                try:
+                    instrument.record(future.result()[1])
+                    finished(name)
+                except Exception as e:
+                    finished(name, e)
+        elif not progressed:
+            break
+
+    if pool:
+        pool.shutdown()
+    print(f"[build] {len(ran)} built, {len(done) - len(ran)} up to date, {len(failed)} failed" + (" (dry run)" if dry_run else ""))
+    return failed
+
+def finish(task, state):
+    # record what was built from what, so the next run can tell whether it still holds
+    state[task.name] = {
+        "fingerprint" : fingerprint(task),
+        "outputs" : { path : file_hash(path) for path in task.outputs if os.path.exists(path) },
+        "built_at" : time.time(),
+        "built" : datetime.datetime.now().isoformat(timespec="seconds"),
+    }
+    save_state(state)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the stale G+ data targets, running independent ones in parallel")
+    parser.add_argument("targets", nargs="*", help="task names (globs ok), stages (gplus, zones, form, windows) or competitions, defaults to everything")
+    parser.add_argument("--only", action="store_true", help="don't pull in the targets' dependencies")
+    parser.add_argument("--jobs", type=int, default=1, help="run up to this many independent tasks at once, in separate processes")
+    parser.add_argument("--force", action="store_true", help="rebuild the selected tasks even when they're up to date")
+    parser.add_argument("--max-age", type=float, default=0, metavar="HOURS", help="treat ASA-fed tasks built less than this long ago as fresh")
+    parser.add_argument("--full-refresh", action="store_true", help="re-pull closed seasons instead of reusing their snapshots")
+    parser.add_argument("--sketch-error", type=float, default=default_error, help="rank error of the stored quantile sketches")
+    parser.add_argument("--dry-run", action="store_true", help="print what would be built and why")
+    parser.add_argument("--list", action="store_true", help="print the task graph and exit")
+    parser.add_argument("--report", metavar="PATH", help="write a JSON report of per-stage timings, memory and request counts")
+    args = parser.parse_args()
+
+    graph = build_graph(args.full_refresh, args.sketch_error)
+    if args.list:
+        for name, task in graph.items():
+            print(f"{name:<24} <- {', '.join(task.deps) or '(ASA)'}")
+        sys.exit(0)
+
+    if args.report:
+        instrument.start_memory_tracing()
+    failed = build(graph, select(graph, args.targets, args.only), args.jobs, args.force, args.max_age, args.dry_run)
+    if args.report:
+        instrument.write_report(args.report, "build.py", vars(args))
+    if len(failed) > 0:
+        print(f"[build] failed: {', '.join(failed)}")
+        sys.exit(1)
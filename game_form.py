@@ -0,0 +1,197 @@
+import pandas as pd
+import numpy as np
+import os
+import argparse
+
+import instrument
+from instrument import span
+from asa_retrieve import client, competitions, gplus_urls, is_open_season, snapshot_root
+from gplus_schema import flatten_records, apply_schema, save_snapshot, load_snapshot, snapshot_valid
+from percentiles import group_quantiles
+from parquet_store import maybe_write_table
+from publish import publish_csv
+
+# games in the rolling form window
+default_window = 5
+# an appearance needs this many minutes to count towards the per-game ladders, a form window this many per game
+default_min_minutes = 45
+form_board_size = 10
+
+def game_snapshot_path(competition, yr):
+    return f"{snapshot_root}/games/{competition}/{yr}.pkl"
+
+def explode_games(competition, yr, records, gk_records):
+    games = pd.concat([
+        flatten_records(records, extra={ "season" : yr }),
+        flatten_records(gk_records, extra={ "general_position" : "GK", "season" : yr })
+    ], ignore_index=True)
+    if len(games) == 0:
+        return pd.DataFrame()
+    return apply_schema(games)
+
+def season_chunks(competition, years, full_refresh = False):
+    # yields (season, spill path) one season at a time, only one season's game payload is ever held in memory
+    for yr in years:
+        path = game_snapshot_path(competition, yr)
+        if full_refresh or is_open_season(competition, yr) or not snapshot_valid(path):
+            payloads = client.fetch_all(gplus_urls(competition, yr, split_by_game=True), client.get_json)
+            with span("game explode", competition=competition, season=yr) as s:
+                chunk = explode_games(competition, yr, payloads[0], payloads[1])
+                s["rows"] = len(chunk)
+            del payloads
+            save_snapshot(chunk, path)
+            del chunk
+        yield yr, path
+
+def player_games(chunk):
+    # one row per player appearance: G+ summed over action types
+    if 'date_time_utc' not in chunk.columns or chunk['date_time_utc'].isna().any():
+        # game_id isn't chronological, so without kickoff times there's no order to build form windows in
+        raise ValueError("per-game G+ rows are missing date_time_utc, can't order each player's games")
+    keys = ['season', 'general_position', 'player_id', 'team_id', 'game_id', 'date_time_utc']
+    games = chunk.groupby(keys, observed=True).agg({
+        'data.goals_added_raw': ['sum'],
+        'minutes_played' : ['mean']
+    }).reset_index()
+    games.columns = games.columns.droplevel(level=1)
+    games = games.rename(columns={ 'data.goals_added_raw' : 'total' })
+    with np.errstate(invalid="ignore", divide="ignore"):
+        games['p96'] = games['total'] * 96 / games['minutes_played']
+    # each player's games in the order they were played
+    return games.sort_values(['player_id', 'date_time_utc', 'game_id'], kind="mergesort").reset_index(drop=True)
+
+def rolling_windows(games, window):
+    # sums over each appearance and the player's (window - 1) games before it, added up exactly rather than through cumsum differences
+    player = games['player_id'].to_numpy()
+    new_player = np.concatenate([[True], player[1:] != player[:-1]]) if len(games) > 0 else np.array([], dtype=bool)
+    group_start = np.maximum.accumulate(np.where(new_player, np.arange(len(games)), 0))
+    game_number = np.arange(len(games)) - group_start
+
+    total = games['total'].to_numpy(dtype=np.float64)
+    minutes = games['minutes_played'].to_numpy(dtype=np.float64)
+    window_total = total.copy()
+    window_minutes = minutes.copy()
+    for lag in range(1, window):
+        reach = game_number >= lag
+        window_total[lag:] += np.where(reach[lag:], total[:-lag], 0.0)
+        window_minutes[lag:] += np.where(reach[lag:], minutes[:-lag], 0.0)
+
+    form = games[['season', 'general_position', 'player_id', 'team_id', 'game_id', 'date_time_utc']].copy()
+    form['games'] = np.minimum(game_number + 1, window)
+    form['minutes'] = window_minutes
+    form['form_total'] = window_total
+    with np.errstate(invalid="ignore", divide="ignore"):
+        form['form_p96'] = window_total * 96 / window_minutes
+    form['latest'] = np.concatenate([player[1:] != player[:-1], [True]]) if len(games) > 0 else np.array([], dtype=bool)
+    return form
+
+def game_percentiles(games, min_minutes):
+    played = games[games.minutes_played >= min_minutes]
+    pct = group_quantiles(played, ['general_position', 'season'], ['p96', 'total'])
+    if len(pct) == 0:
+        return pd.DataFrame()
+    return pd.DataFrame({ "position" : pct["general_position"], "season" : pct["season"], "pct" : pct["pct"], "p96" : pct["p96"], "pGame" : pct["total"] })
+
+def form_percentiles(form, window, min_minutes):
+    full = form[(form.games == window) & (form.minutes >= window * min_minutes)]
+    pct = group_quantiles(full, ['general_position', 'season'], ['form_p96', 'form_total'])
+    if len(pct) == 0:
+        return pd.DataFrame()
+    return pd.DataFrame({ "position" : pct["general_position"], "season" : pct["season"], "window" : window, "pct" : pct["pct"], "p96" : pct["form_p96"], "pWindow" : pct["form_total"] })
+
+def form_leaderboards(form, window, min_minutes):
+    # top players by their latest full window, overall and per position, for each of form_p96/form_total
+    current = form[form.latest & (form.games == window) & (form.minutes >= window * min_minutes)].copy()
+    current['general_position'] = current['general_position'].astype(str)
+    boards = []
+    for position in ['All'] + sorted(current['general_position'].unique().tolist()):
+        rows = current if position == 'All' else current[current.general_position == position]
+        for rank_type, column in [('p96', 'form_p96'), ('total', 'form_total')]:
+            # ties keep player_id order so reruns publish the same board
+            top = rows.sort_values('player_id', kind="mergesort").sort_values(column, ascending=False, kind="mergesort").head(form_board_size).copy()
+            top['rank'] = top[column].rank(ascending=False, method="min")
+            top['position'] = position
+            top['rank_type'] = rank_type
+            boards.append(top)
+    if len(boards) == 0:
+        return pd.DataFrame()
+    ranks = pd.concat(boards, ignore_index=True)
+    ranks = ranks.rename(columns={ 'game_id' : 'last_game_id', 'date_time_utc' : 'last_game_date' })
+    return ranks[['season', 'position', 'rank_type', 'rank', 'player_id', 'team_id', 'games', 'minutes', 'form_total', 'form_p96', 'last_game_id', 'last_game_date']]
+
+def append_csv(df, path, header):
+    # an empty season writes nothing, so the header goes out with the first season that has rows
+    if len(df) == 0:
+        return header
+    df.to_csv(path, index=False, mode="w" if header else "a", header=header)
+    return False
+
+def process_competition(competition, start_year, end_year, window = default_window, min_minutes = default_min_minutes, full_refresh = False):
+    base_path = f"./data/{competition}"
+    os.makedirs(base_path, exist_ok=True)
+    outputs = {
+        "game-g+-pct" : f"{base_path}/game-g+-pct.csv",
+        "form-g+-pct" : f"{base_path}/form-g+-pct.csv",
+        "form-g+-ranks" : f"{base_path}/form-g+-ranks.csv",
+    }
+    # a table's header is still owed until one of its seasons has rows
+    header = { table : True for table in outputs }
+    for table, path in outputs.items():
+        if os.path.exists(f"{path}.partial"):
+            os.remove(f"{path}.partial")
+    for yr, path in season_chunks(competition, range(start_year, end_year), full_refresh):
+        # everything below only ever looks at this one season's chunk
+        chunk = load_snapshot(path)
+        if len(chunk) == 0:
+            print(f"No per-game G+ data for {competition} in {yr}")
+            continue
+
+        with span("player games", competition=competition, season=yr) as s:
+            games = player_games(chunk)
+            s["rows"] = len(games)
+        del chunk
+        with span("form windows", competition=competition, season=yr) as s:
+            form = rolling_windows(games, window)
+            s["rows"] = len(form)
+        with span("game percentiles", competition=competition, season=yr) as s:
+            tables = {
+                "game-g+-pct" : game_percentiles(games, min_minutes),
+                "form-g+-pct" : form_percentiles(form, window, min_minutes),
+                "form-g+-ranks" : form_leaderboards(form, window, min_minutes),
+            }
+            s["rows"] = sum(len(t) for t in tables.values())
+
+        for table, df in tables.items():
+            with span("write", table=table, competition=competition, season=yr) as s:
+                s["rows"] = len(df)
+                header[table] = append_csv(df, f"{outputs[table]}.partial", header[table])
+                maybe_write_table(df, table, competition, 'season')
+        print(f"Built form tables for {competition} {yr} from {len(games)} player games over a {window} game window")
+        del games, form, tables
+
+    # the finished tables are small, publish them in one go so unchanged seasons aren't rewritten
+    for table, path in outputs.items():
+        if os.path.exists(f"{path}.partial"):
+            publish_csv(pd.read_csv(f"{path}.partial", float_precision="round_trip"), path, table, competition, 'season')
+            os.remove(f"{path}.partial")
+
+def main(selected = None, start_year = None, window = default_window, min_minutes = default_min_minutes, full_refresh = False):
+    for c in competitions:
+        if selected and c["competition"] not in selected:
+            continue
+        process_competition(c["competition"], max(c["start_year"], start_year or c["start_year"]), c["end_year"], window, min_minutes, full_refresh)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build per-game and rolling form G+ percentiles and leaderboards, one season at a time")
+    parser.add_argument("--competition", action="append", help="only these competitions (repeatable), defaults to all")
+    parser.add_argument("--start-year", type=int, help="skip seasons before this one")
+    parser.add_argument("--window", type=int, default=default_window, help="games in the rolling form window")
+    parser.add_argument("--min-minutes", type=int, default=default_min_minutes, help="minutes per game to count towards ladders and form boards")
+    parser.add_argument("--full-refresh", action="store_true", help="re-pull closed seasons instead of reusing their spilled chunks")
+    parser.add_argument("--report", metavar="PATH", help="write a JSON report of per-stage timings, memory and request counts")
+    args = parser.parse_args()
+    if args.report:
+        instrument.start_memory_tracing()
+    main(args.competition, args.start_year, args.window, args.min_minutes, args.full_refresh)
+    if args.report:
+        instrument.write_report(args.report, "game_form.py", vars(args))
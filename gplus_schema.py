@@ -0,0 +1,104 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import hashlib
+
+# GPLUS_FLOAT32=1 stores the G+ metrics as float32, halving their memory at the cost of float64-exact outputs
+metric_dtype = "float32" if os.environ.get("GPLUS_FLOAT32", "0") == "1" else "float64"
+
+# declared dtypes for the exploded player/GK goals-added frame, columns not listed keep whatever pandas infers
+gplus_schema = {
+    "player_id" : "category",
+    "team_id" : "category",
+    "general_position" : "category",
+    "season_name" : "category",
+    "season" : "int16",
+    "minutes_played" : "int32",
+    "data.action_type" : "category",
+    "game_id" : "category",
+    "data.goals_added_raw" : metric_dtype,
+    "data.goals_added_above_avg" : metric_dtype,
+    "data.count_actions" : "int32",
+}
+
+def column_values(values):
+    # numpy array from a list of JSON scalars, None becomes NaN for numbers
+    return pd.Series(values).to_numpy()
+
+def flatten_records(records, record_path = "data", extra = None):
+    # one row per entry of each record's `record_path` list, record fields repeated alongside as typed columns
+    extra = extra or {}
+    # like DataFrame.explode, a record with an empty list still gets one row with missing values
+    nested = [r.get(record_path) or [{}] for r in records]
+    counts = np.array([len(n) for n in nested], dtype=np.int64)
+    total = int(counts.sum())
+
+    meta_keys = []
+    for r in records:
+        for k in r.keys():
+            if k != record_path and k not in meta_keys:
+                meta_keys.append(k)
+    for k in extra.keys():
+        if k not in meta_keys:
+            meta_keys.append(k)
+
+    columns = {}
+    for k in meta_keys:
+        if k in extra:
+            columns[k] = np.repeat(np.asarray([extra[k]], dtype=object), total)
+        else:
+            columns[k] = np.repeat(column_values([r.get(k) for r in records]), counts)
+
+    items = [item for n in nested for item in n]
+    item_keys = []
+    for item in items:
+        for k in item.keys():
+            if k not in item_keys:
+                item_keys.append(k)
+    for k in item_keys:
+        columns[f"{record_path}.{k}"] = column_values([item.get(k) for item in items])
+
+    return pd.DataFrame(columns, index=pd.RangeIndex(total))
+
+def apply_schema(df, schema = gplus_schema):
+    for column, dtype in schema.items():
+        if column not in df.columns:
+            continue
+        values = df[column]
+        if dtype == "category":
+            # season names arrive as both "2023" and 2023 depending on the source, categories are always strings
+            if values.dtype != "category":
+                values = values.where(values.isna(), values.astype(str))
+            df[column] = values.astype("category")
+        elif dtype.startswith("int"):
+            df[column] = values.astype(dtype) if values.notna().all() else values.astype("float64")
+        else:
+            df[column] = values.astype(dtype)
+    return df
+
+def snapshot_stamp():
+    # what a pickled snapshot depends on: the Actions cache can hand back pickles from another pandas/numpy (which may not load, or load wrong) or from an older schema
+    schema = hashlib.sha256(json.dumps(gplus_schema, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return { "pandas" : pd.__version__, "numpy" : np.__version__, "schema" : schema }
+
+def stamp_path(path):
+    return f"{path}.stamp.json"
+
+def save_snapshot(obj, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.to_pickle(obj, path)
+    with open(stamp_path(path), "w") as f:
+        json.dump(snapshot_stamp(), f)
+
+def snapshot_valid(path):
+    # False when missing, unstamped or written under another stamp, callers treat that as a cache miss
+    if not os.path.exists(path) or not os.path.exists(stamp_path(path)):
+        return False
+    with open(stamp_path(path)) as f:
+        return json.load(f) == snapshot_stamp()
+
+def load_snapshot(path):
+    if not snapshot_valid(path):
+        return None
+    return pd.read_pickle(path)
@@ -0,0 +1,113 @@
+import os
+import json
+import time
+import datetime
+import resource
+import tracemalloc
+from contextlib import contextmanager
+
+# GPLUS_TRACE_MEMORY=0 skips tracemalloc (it slows allocation-heavy stages down), spans then only report timings and counts
+trace_memory = os.environ.get("GPLUS_TRACE_MEMORY", "1") != "0"
+
+# finished spans for this process, in the order they closed
+spans = []
+# spans still running, innermost last
+open_spans = []
+# objects exposing request_count/retry_count/cache_hits (every AsaClient registers itself)
+counter_sources = []
+run_started = time.time()
+
+def track_counters(source):
+    counter_sources.append(source)
+
+def counters():
+    return {
+        "requests" : sum(s.request_count for s in counter_sources),
+        "retries" : sum(s.retry_count for s in counter_sources),
+        "cache_hits" : sum(s.cache_hits for s in counter_sources),
+    }
+
+def start_memory_tracing():
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def fold_peak():
+    # tracemalloc only keeps one global peak, so push it into every open span before it gets reset
+    if not tracemalloc.is_tracing():
+        return
+    peak = tracemalloc.get_traced_memory()[1]
+    for record in open_spans:
+        record["peak_bytes"] = max(record["peak_bytes"], peak)
+    tracemalloc.reset_peak()
+
+@contextmanager
+def span(name, **tags):
+    # times the block, callers can fill in record["rows"] (or any other field) while it runs
+    fold_peak()
+    record = {
+        "name" : name,
+        "parent" : open_spans[-1]["name"] if open_spans else None,
+        "pid" : os.getpid(),
+        **tags,
+        "rows" : None,
+        "peak_bytes" : tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0,
+    }
+    start_counts = counters()
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    open_spans.append(record)
+    try:
+        yield record
+    finally:
+        fold_peak()
+        open_spans.pop()
+        record["wall_s"] = round(time.perf_counter() - start_wall, 4)
+        record["cpu_s"] = round(time.process_time() - start_cpu, 4)
+        record["peak_mb"] = round(record.pop("peak_bytes") / (1024 * 1024), 2) if tracemalloc.is_tracing() else None
+        end_counts = counters()
+        for k in start_counts.keys():
+            record[k] = end_counts[k] - start_counts[k]
+        spans.append(record)
+
+def tracing():
+    # whether this process is tracing memory, pass it along to collect so workers only trace when a report was asked for
+    return tracemalloc.is_tracing()
+
+def collect(trace, fn, *args, **kwargs):
+    # runs fn (e.g. in a pool worker) and hands back its result along with the spans it recorded
+    if trace:
+        start_memory_tracing()
+    start = len(spans)
+    result = fn(*args, **kwargs)
+    return result, spans[start:]
+
+def record(records):
+    spans.extend(records)
+
+def summary():
+    # slowest first, one line per span
+    lines = []
+    for s in sorted(spans, key=lambda s: -s["wall_s"]):
+        tags = " ".join(f"{k}={s[k]}" for k in ["competition", "season", "endpoint", "table"] if s.get(k) is not None)
+        lines.append(f"{s['wall_s']:>9.3f}s wall {s['cpu_s']:>9.3f}s cpu {s['peak_mb'] if s['peak_mb'] is not None else '-':>9} MB peak {s['requests']:>5} req  {s['name']} {tags}".rstrip())
+    return "\n".join(lines)
+
+def write_report(path, script, args = None):
+    report = {
+        "script" : script,
+        "args" : args or {},
+        "started_at" : datetime.datetime.fromtimestamp(run_started).isoformat(),
+        "wall_s" : round(time.time() - run_started, 4),
+        # ru_maxrss is KB on linux
+        "max_rss_mb" : round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+        "max_child_rss_mb" : round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 2),
+        **counters(),
+        "spans" : spans,
+    }
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Stage timings:\n{summary()}")
+    print(f"Wrote run report with {len(spans)} spans to {path}")
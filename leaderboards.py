@@ -0,0 +1,251 @@
+import pandas as pd
+import numpy as np
+import os
+import argparse
+
+from gplus_schema import save_snapshot, load_snapshot
+
+leaderboard_size = 10
+rank_index_root = "./snapshots/rank_index"
+rank_columns = ['season_name', 'player_id', 'data.goals_added_raw', 'minutes_played', 'total', 'total_rank', 'p96', 'p96_rank', 'team_id', 'position', 'action_type']
+
+# (drop GKs?, leaderboard keys) for every leaderboard family built per season
+leaderboard_levels = [
+    (True, []),
+    (False, ['general_position']),
+    (False, ['data.action_type']),
+    (False, ['data.action_type', 'general_position']),
+    (False, ['team_id', 'data.action_type']),
+    (False, ['team_id', 'data.action_type', 'general_position']),
+    (False, ['team_id', 'general_position']),
+    (True, ['team_id']),
+]
+
+def rank_threshold(base, fraction = 0.25):
+    # minutes cutoff per season: `fraction` of the most full games (max minutes / 96) played that season
+    max_minutes = base.groupby('season')['minutes_played'].max()
+    max_games = np.floor(max_minutes / 96)
+    return (max_games * fraction) * 96
+
+def eligible_rows(base, fraction = 0.25):
+    threshold = base['season'].map(rank_threshold(base, fraction))
+    return base[base.minutes_played >= threshold]
+
+def leaderboard_order(years, teams, positions, action_types):
+    # the order the leaderboards have always been written to player-g+-ranks.csv in
+    boards = []
+    for year in years:
+        boards.append((year, 'All', 'All', 'All'))
+        for pos in positions:
+            boards.append((year, 'All', pos, 'All'))
+        for action_type in action_types:
+            boards.append((year, 'All', 'All', action_type))
+            for pos in positions:
+                boards.append((year, 'All', pos, action_type))
+        for team in teams:
+            for action_type in action_types:
+                boards.append((year, team, 'All', action_type))
+                for pos in positions:
+                    boards.append((year, team, pos, action_type))
+            for pos in positions:
+                boards.append((year, team, pos, 'All'))
+            boards.append((year, team, 'All', 'All'))
+    boards = pd.DataFrame(boards, columns=['season', 'team_id', 'position', 'action_type'])
+    boards['board'] = np.arange(len(boards))
+    return boards
+
+def level_entries(rows, keys):
+    # every (player, board) aggregate a minutes cutoff can produce: the rows at or above each of the player's distinct minutes values, summed in row order like the groupby over eligible rows
+    rows = rows[rows['minutes_played'].notna()]
+    unit_keys = ['season'] + keys + ['season_name', 'player_id']
+    unit = rows.groupby(unit_keys, observed=True).ngroup().to_numpy()
+    minutes = rows['minutes_played'].to_numpy(dtype=np.float64)
+    levels = pd.DataFrame({'unit' : unit, 'level' : minutes}).drop_duplicates()
+    expanded = pd.DataFrame({
+        'unit' : unit,
+        'minutes' : minutes,
+        'data.goals_added_raw' : rows['data.goals_added_raw'].to_numpy(),
+        'minutes_played' : rows['minutes_played'].to_numpy(),
+    }).merge(levels, on='unit')
+    expanded = expanded[expanded['minutes'] >= expanded['level']]
+    grouped = expanded.groupby(['unit', 'level']).agg({
+        'data.goals_added_raw': ['sum'],
+        'minutes_played' : ['mean']
+    }).reset_index()
+    grouped.columns = grouped.columns.droplevel(level=1)
+
+    first = rows.assign(unit=unit).drop_duplicates('unit').set_index('unit')
+    labels = first.loc[grouped['unit'].to_numpy()]
+    entries = pd.DataFrame({
+        'season' : labels['season'].to_numpy(),
+        'team_id' : labels['team_id'].to_numpy() if 'team_id' in keys else 'All',
+        'position' : labels['general_position'].to_numpy() if 'general_position' in keys else 'All',
+        'action_type' : labels['data.action_type'].to_numpy() if 'data.action_type' in keys else 'All',
+        'season_name' : labels['season_name'].to_numpy(),
+        'player_id' : labels['player_id'].to_numpy(),
+        'unit' : grouped['unit'].to_numpy(),
+        'level' : grouped['level'].to_numpy(),
+        'total' : grouped['data.goals_added_raw'].to_numpy(),
+        'minutes_played' : grouped['minutes_played'].to_numpy(),
+    })
+    # the player's next lower minutes value on this board: the entry is the one in use for cutoffs in (next_level, level]
+    same_unit = np.append(entries['unit'].to_numpy()[1:] == entries['unit'].to_numpy()[:-1], False)
+    entries['next_level'] = np.where(np.roll(same_unit, 1), np.roll(entries['level'].to_numpy(), 1), -np.inf)
+    return entries
+
+def ranked_runs(values, board, tiebreak):
+    # (order, average rank) of `values` within each board, best first with NaN last, ties in `tiebreak` order like the stable sort on rank over groupby output
+    missing = np.isnan(values)
+    order = np.lexsort((tiebreak, np.where(missing, 0, -values), missing, board))
+    v = values[order]
+    b = board[order]
+    new_board = np.concatenate([[True], b[1:] != b[:-1]]) if len(v) > 0 else np.array([], dtype=bool)
+    new_run = new_board | np.concatenate([[True], ~(v[1:] == v[:-1])]) if len(v) > 0 else new_board
+    position = np.arange(len(v))
+    board_start = np.maximum.accumulate(np.where(new_board, position, 0))
+    run = np.cumsum(new_run) - 1
+    run_start = position[new_run][run]
+    run_length = np.bincount(run)[run]
+    rank = (run_start - board_start) + 1 + (run_length - 1) / 2
+    rank = np.where(missing[order], np.nan, rank)
+    return order, rank, position - board_start
+
+class RankIndex:
+    # every leaderboard's candidate aggregates sorted by minutes (most first), so the entries eligible at any cutoff are a prefix of each board's slice
+    def __init__(self, entries, boards, max_minutes):
+        self.boards = boards.reset_index(drop=True)
+        # per season: max minutes over all rows and over outfield rows (the GK-less boards compute their cutoff from those)
+        self.max_minutes = max_minutes
+        self.levels = np.unique(entries['level'].to_numpy())
+        rank = len(self.levels) - 1 - np.searchsorted(self.levels, entries['level'].to_numpy())
+        order = np.lexsort((entries['unit'].to_numpy(), rank, entries['board'].to_numpy()))
+        self.entries = entries.iloc[order].reset_index(drop=True)
+        board = self.entries['board'].to_numpy()
+        # (board, minutes rank) packed into one sorted int64, a cutoff's prefix end per board is one searchsorted
+        self.packed = board * len(self.levels) + rank[order]
+        self.bounds = np.searchsorted(board, np.arange(len(self.boards) + 1))
+
+    def cutoffs(self, fraction = 0.25, minutes = None):
+        # minutes cutoff of every board: `minutes` when given, else fraction of the season's most full games like rank_threshold
+        if minutes is not None:
+            return np.full(len(self.boards), float(minutes))
+        max_minutes = self.max_minutes.loc[self.boards['season'].to_numpy()]
+        max_minutes = np.where(self.boards['no_gk'].to_numpy(), max_minutes['no_gk'].to_numpy(), max_minutes['all'].to_numpy())
+        max_games = np.floor(max_minutes / 96)
+        return (max_games * fraction) * 96
+
+    def select(self, season = None, team_id = None, position = None, action_type = None):
+        # board numbers matching the given keys (None matches any)
+        match = np.ones(len(self.boards), dtype=bool)
+        for column, value in [('season', season), ('team_id', team_id), ('position', position), ('action_type', action_type)]:
+            if value is not None:
+                match &= (self.boards[column].astype(str) == str(value)).to_numpy()
+        return np.nonzero(match)[0]
+
+    def eligible(self, boards, cutoff):
+        # entry positions in use on these boards at their cutoffs: the minutes-sorted prefix at or above the cutoff, keeping each player's lowest level in it
+        threshold = cutoff[boards]
+        ladder = np.searchsorted(self.levels, threshold, side='left')
+        end = np.searchsorted(self.packed, boards * len(self.levels) + (len(self.levels) - 1 - ladder), side='right')
+        start = self.bounds[boards]
+        lengths = np.maximum(end - start, 0)
+        positions = np.repeat(start - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return positions[self.entries['next_level'].to_numpy()[positions] < np.repeat(threshold, lengths)]
+
+    def top(self, boards = None, fraction = 0.25, minutes = None, n = leaderboard_size):
+        # [total, p96] top n lists of these boards (default all) in board order, with the player-g+-ranks columns
+        boards = np.arange(len(self.boards)) if boards is None else np.asarray(boards, dtype=np.int64)
+        cutoff = self.cutoffs(fraction, minutes)
+        positions = self.eligible(boards, cutoff)
+        rows = self.entries.iloc[positions].reset_index(drop=True)
+        rows['data.goals_added_raw'] = rows['total']
+        rows['p96'] = rows['data.goals_added_raw'] * 96 / rows['minutes_played']
+        board = rows['board'].to_numpy()
+
+        ranks = []
+        ranked = {}
+        for column in ['total', 'p96']:
+            order, rank, slot = ranked_runs(rows[column].to_numpy(dtype=np.float64), board, rows['unit'].to_numpy())
+            rows.loc[order, f'{column}_rank'] = rank
+            ranked[column] = (order, slot)
+        for column in ['total', 'p96']:
+            order, slot = ranked[column]
+            ranks.append(rows.iloc[order[slot < n]][rank_columns].reset_index(drop=True))
+        return ranks
+
+    def board(self, season, team_id = 'All', position = 'All', action_type = 'All', rank_type = 'p96', fraction = 0.25, minutes = None, n = leaderboard_size):
+        # one leaderboard at any cutoff, None when there's no such board
+        boards = self.select(season, team_id, position, action_type)
+        if len(boards) == 0:
+            return None
+        total, p96 = self.top(boards, fraction, minutes, n)
+        return p96 if rank_type == 'p96' else total
+
+def build_rank_index(base, years, teams, positions, action_types):
+    print(f"Indexing player aggregates across {len(leaderboard_levels)} leaderboard families for {len(years)} seasons...")
+    no_gk_base = base[base.general_position != 'GK']
+    entries = []
+    for (drop_gk, keys) in leaderboard_levels:
+        level = level_entries(no_gk_base if drop_gk else base, keys)
+        level['no_gk'] = drop_gk
+        entries.append(level)
+    entries = pd.concat(entries, ignore_index=True)
+
+    boards = leaderboard_order(years, teams, positions, action_types)
+    entries = entries.merge(boards, on=['season', 'team_id', 'position', 'action_type'])
+    # unit numbers restart per family, a board only ever holds one family's
+    used = boards[boards['board'].isin(entries['board'].unique())].copy()
+    used['no_gk'] = used['board'].map(entries.drop_duplicates('board').set_index('board')['no_gk']).astype(bool)
+    used['new_board'] = np.arange(len(used))
+    entries['board'] = entries['board'].map(used.set_index('board')['new_board'])
+    used = used.drop(columns=['board', 'new_board'])
+
+    max_minutes = pd.DataFrame({
+        'all' : base.groupby('season')['minutes_played'].max(),
+        'no_gk' : no_gk_base.groupby('season')['minutes_played'].max(),
+    })
+    index = RankIndex(entries.drop(columns=['no_gk']), used, max_minutes)
+    print(f"Indexed {len(index.entries)} player aggregates on {len(index.boards)} non-empty leaderboards")
+    return index
+
+def build_leaderboards(base, years, teams, positions, action_types, fraction = 0.25):
+    # [total, p96] top 10s of every leaderboard at the `fraction` of max games cutoff
+    index = build_rank_index(base, years, teams, positions, action_types)
+    print(f"Selecting top {leaderboard_size}s...")
+    return index.top(fraction=fraction)
+
+def rank_index_path(competition):
+    return f"{rank_index_root}/{competition}.pkl"
+
+def save_rank_index(index, competition):
+    save_snapshot(index, rank_index_path(competition))
+
+def load_rank_index(competition):
+    # the index asa_retrieve.py stored on its last run, None when there isn't one (or it's from another pandas/numpy)
+    return load_snapshot(rank_index_path(competition))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-rank the stored leaderboards at another minutes cutoff without rerunning the pipeline")
+    parser.add_argument("competition")
+    parser.add_argument("--season", type=int, help="only this season's boards")
+    parser.add_argument("--team", help="only this team's boards (All for the league-wide ones)")
+    parser.add_argument("--position", help="only this position's boards (All for every position)")
+    parser.add_argument("--action-type", help="only this action type's boards (All for every action)")
+    parser.add_argument("--rank-type", choices=["total", "p96"], default="p96")
+    parser.add_argument("--fraction", type=float, default=0.25, help="cutoff as a fraction of the season's most full games played")
+    parser.add_argument("--minutes", type=float, help="cutoff in minutes, instead of --fraction")
+    parser.add_argument("-n", type=int, default=leaderboard_size)
+    parser.add_argument("--out", help="write the selected boards to this CSV instead of printing them")
+    args = parser.parse_args()
+
+    index = load_rank_index(args.competition)
+    if index is None:
+        raise SystemExit(f"No rank index stored for {args.competition}, run asa_retrieve.py first")
+    boards = index.select(args.season, args.team, args.position, args.action_type)
+    total, p96 = index.top(boards, args.fraction, args.minutes, args.n)
+    ranks = p96 if args.rank_type == "p96" else total
+    if args.out:
+        ranks.to_csv(args.out, index=False)
+        print(f"Wrote {len(ranks)} ranks on {len(boards)} leaderboards to {args.out}")
+    else:
+        print(ranks.to_string(index=False))
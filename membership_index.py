@@ -0,0 +1,82 @@
+import pandas as pd
+import numpy as np
+import os
+
+# every (competition, player, season, team) membership ever seen, appended to as new ones turn up
+index_path = "./data/player_membership.csv"
+# players whose memberships have been looked up on ASA, and the season they were last looked up in
+resolved_path = "./data/player_membership_resolved.csv"
+
+key_columns = ["competition", "player_id", "season_name", "team_id"]
+index_columns = key_columns + ["source"]
+resolved_columns = ["competition", "player_id", "resolved_season"]
+
+def season_names(values):
+    # seasons come back as 2023, 2023.0 or "2023-24" depending on where they were read from
+    return values.astype(str).str.replace(".0", "")
+
+def empty_index():
+    return pd.DataFrame(columns=index_columns, dtype=str)
+
+def empty_resolved():
+    return pd.DataFrame({ "competition" : pd.Series(dtype=str), "player_id" : pd.Series(dtype=str), "resolved_season" : pd.Series(dtype=np.int64) })
+
+def load_index(path = index_path):
+    if not os.path.exists(path):
+        return empty_index()
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
+
+def load_resolved(path = resolved_path):
+    if not os.path.exists(path):
+        return empty_resolved()
+    return pd.read_csv(path, dtype={ "competition" : str, "player_id" : str, "resolved_season" : np.int64 })
+
+def save(index, resolved, path = index_path, resolved_file = resolved_path):
+    index[index_columns].to_csv(path, index=False)
+    resolved[resolved_columns].to_csv(resolved_file, index=False)
+
+def add_memberships(index, rows, competition, source):
+    # appends the memberships in `rows` the index doesn't have yet, team 'All' rows are leaderboard totals and not memberships
+    rows = rows[["player_id", "season_name", "team_id"]].copy()
+    rows.insert(0, "competition", competition)
+    rows["season_name"] = season_names(rows["season_name"])
+    rows = rows[rows.team_id != "All"].astype(str).drop_duplicates(key_columns)
+    known = pd.MultiIndex.from_frame(index[key_columns])
+    new_rows = rows[~pd.MultiIndex.from_frame(rows[key_columns]).isin(known)].copy()
+    new_rows["source"] = source
+    if len(new_rows) == 0:
+        return index, 0
+    return pd.concat([index, new_rows[index_columns]], ignore_index=True), len(new_rows)
+
+def players_to_resolve(index, resolved, competition, player_ids, current_season):
+    # never looked up, or last looked up before this season while they were still playing (a new membership may have appeared since)
+    player_ids = pd.Series(pd.unique(pd.Series(player_ids, dtype=str)))
+    done = resolved[resolved.competition == competition].set_index("player_id")["resolved_season"]
+    seen = index[index.competition == competition]
+    # "2024-25" counts as 2024
+    last_season = seen["season_name"].str[:4].astype(np.int64).groupby(seen["player_id"]).max()
+
+    resolved_in = player_ids.map(done)
+    active = player_ids.map(last_season).fillna(-1) >= current_season - 1
+    stale = resolved_in.notna() & (resolved_in < current_season) & active
+    return player_ids[resolved_in.isna() | stale].tolist()
+
+def mark_resolved(resolved, competition, player_ids, current_season):
+    if len(player_ids) == 0:
+        return resolved
+    others = resolved[~((resolved.competition == competition) & resolved.player_id.isin(player_ids))]
+    marked = pd.DataFrame({ "competition" : competition, "player_id" : list(player_ids), "resolved_season" : current_season })
+    return pd.concat([others, marked], ignore_index=True)
+
+def player_lookup(index, names, competitions):
+    # one row per named membership, competitions in `competitions` order and memberships in the order they joined the index
+    frames = []
+    for competition in competitions:
+        members = index[index.competition == competition]
+        frames.append(pd.merge(members, names[competition], on="player_id"))
+    lookup = pd.concat(frames, axis=0)
+    lookup = lookup[(lookup.team_id != "All") & (lookup.player_name != "")].drop_duplicates(key_columns)
+    return lookup[["competition", "season_name", "team_id", "player_id", "player_name"]]
+
+def team_lookup(players):
+    return players.drop_duplicates(["competition", "season_name", "team_id"])[["competition", "season_name", "team_id"]]
@@ -0,0 +1,88 @@
+import pandas as pd
+import os
+import shutil
+
+from instrument import span
+from publish import publish_csv, partition_labels
+
+# GPLUS_PARQUET=1 makes every writer also emit partitioned parquet next to its CSV
+parquet_enabled = os.environ.get("GPLUS_PARQUET", "0") == "1"
+parquet_root = os.environ.get("GPLUS_PARQUET_DIR", "./parquet")
+
+# low-cardinality string columns stored as dictionary-encoded categoricals
+categorical_columns = ["competition", "position", "general_position", "action_type", "data.action_type", "team_id", "player_id", "player_name", "rank_type"]
+
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("parquet output needs pyarrow, install it with: pip install pyarrow")
+    return pyarrow
+
+def table_path(table):
+    return f"{parquet_root}/{table}"
+
+def partition_path(table, competition = None):
+    path = table_path(table)
+    return path if competition is None else f"{path}/competition={competition}"
+
+def write_table(df, table, competition = None, season_column = None):
+    # writes <root>/<table>/competition=<c>/<season_column>=<s>/part-0.parquet, replacing the partitions being written
+    pa = require_pyarrow()
+    out = df.copy()
+    partition_cols = []
+    if competition is not None:
+        out.insert(0, "competition", competition)
+    if "competition" in out.columns:
+        partition_cols.append("competition")
+    if season_column is not None:
+        out[season_column] = out[season_column].astype(str)
+        partition_cols.append(season_column)
+
+    for column in categorical_columns:
+        if column in out.columns and column not in partition_cols:
+            out[column] = out[column].astype("category")
+
+    print(f"Writing {len(out)} rows to parquet table {table_path(table)} partitioned by {partition_cols}...")
+    pa.parquet.write_to_dataset(
+        pa.Table.from_pandas(out, preserve_index=False),
+        root_path=table_path(table),
+        partition_cols=partition_cols,
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching"
+    )
+
+def maybe_write_table(df, table, competition = None, season_column = None):
+    # an empty frame has no partition columns to write
+    if parquet_enabled and len(df) > 0:
+        write_table(df, table, competition, season_column)
+
+def drop_partitions(table, competition, season_column, seasons):
+    for season in seasons:
+        path = partition_path(table, competition)
+        if season_column is not None:
+            path = f"{path}/{season_column}={season}"
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+def write_outputs(df, csv_path, table, competition = None, season_column = None):
+    # the CSV the site reads (skipped when unchanged, see publish.py), plus a parquet copy of the partitions that changed when that's turned on
+    with span("write", table=table, competition=competition) as s:
+        s["rows"] = len(df)
+        changed, removed = publish_csv(df, csv_path, table, competition, season_column)
+        s["changed_partitions"] = len(changed)
+        # a competition with no parquet partitions yet gets all of them, even when its CSV was already up to date
+        bootstrap = not os.path.isdir(partition_path(table, competition))
+        if parquet_enabled and (len(changed) > 0 or len(removed) > 0 or bootstrap):
+            if bootstrap:
+                changed = partition_labels(df, season_column).unique().tolist()
+            rows = df[partition_labels(df, season_column).isin(changed).to_numpy()]
+            if len(rows) > 0:
+                write_table(rows, table, competition, season_column)
+            drop_partitions(table, competition, season_column, removed)
+
+def load_table(table, columns = None, filters = None):
+    # columns projects, filters (e.g. [("competition", "==", "mls"), ("season", "==", "2023")]) are pushed down to partitions and row groups
+    require_pyarrow()
+    return pd.read_parquet(table_path(table), engine="pyarrow", columns=columns, filters=filters)
@@ -0,0 +1,254 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+import argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from asa_retrieve import competitions
+
+# (file under data/<competition>/ or data/, key columns, ladder columns) for each published quantile table
+table_specs = {
+    "season" : ("season-g+-pct.csv", ["competition", "season", "position", "action_type"], ["p96", "pSzn"]),
+    "player" : ("player-g+-pct.csv", ["competition", "season", "position"], ["p96", "pSzn"]),
+    "zone" : ("percentile-g+-zones.csv", ["competition", "season", "zone", "game_state"], ["for_p96", "for_pSzn", "against_p96", "against_pSzn", "net_p96", "net_pSzn", "trans_net_p96", "trans_net_pSzn"]),
+}
+
+# competitions whose copy of a table sits at the top of data/ instead of data/<competition>/ (mls zone files predate the other competitions)
+top_level = { "zone" : "mls" }
+
+# largest key space (product of distinct values per key column) indexed with a dense lookup array
+dense_limit = 1 << 24
+
+def key_strings(values):
+    # keys compare as strings so 2023, "2023" and 2023.0 from a CSV/query string all match
+    values = pd.Series(np.asarray(values, dtype=object).ravel())
+    numeric = pd.to_numeric(values, errors="coerce")
+    whole = numeric.notna() & (numeric == np.floor(numeric))
+    out = values.astype(str)
+    out[whole] = numeric[whole].astype(np.int64).astype(str)
+    return out.to_numpy()
+
+def row_searchsorted(ladders, rows, values):
+    # np.searchsorted(ladders[row], value, side="right") for every (row, value) pair at once, as a branchless binary search over the ladder width
+    width = ladders.shape[1]
+    flat = ladders.ravel()
+    offsets = rows * width
+    lo = np.zeros(len(values), dtype=np.int64)
+    hi = np.full(len(values), width, dtype=np.int64)
+    while True:
+        active = lo < hi
+        if not active.any():
+            return lo
+        mid = (lo + hi) // 2
+        go_right = active & (flat[offsets + np.minimum(mid, width - 1)] <= values)
+        lo = np.where(go_right, mid + 1, lo)
+        hi = np.where(active & ~go_right, mid, hi)
+
+class QuantileTable:
+    # one contiguous (keys x ladder steps) float64 array per metric, rows addressed through a key index
+    def __init__(self, frame, keys, metrics, pct_column = "pct"):
+        frame = frame.copy()
+        for k in keys:
+            frame[k] = key_strings(frame[k])
+        frame = frame.sort_values(keys + [pct_column], kind="mergesort")
+        self.keys = keys
+        self.metrics = metrics
+        self.pct = np.sort(frame[pct_column].unique()).astype(np.float64)
+        width = len(self.pct)
+
+        # each key column becomes codes into its sorted levels, and a key tuple one mixed-radix integer
+        self.levels = { k : pd.Index(np.sort(frame[k].unique())) for k in keys }
+        self.radix = [len(self.levels[k]) for k in keys]
+        codes = self.composite([self.levels[k].get_indexer(frame[k]) for k in keys])
+        self.codes, rows = np.unique(codes, return_inverse=True)
+        # small key spaces (every table we publish) get a dense code -> row array instead of a binary search
+        space = int(np.prod(self.radix, dtype=np.float64))
+        self.dense = None
+        if space <= dense_limit:
+            self.dense = np.full(space, -1, dtype=np.int64)
+            self.dense[self.codes] = np.arange(len(self.codes))
+        steps = np.searchsorted(self.pct, frame[pct_column].to_numpy())
+        self.ladders = {}
+        for m in metrics:
+            ladder = np.full((len(self.codes), width), np.nan)
+            ladder[rows, steps] = frame[m].to_numpy(dtype=np.float64)
+            self.ladders[m] = ladder
+
+    def __len__(self):
+        return len(self.codes)
+
+    def composite(self, key_codes):
+        code = np.zeros(len(key_codes[0]), dtype=np.int64)
+        for c, radix in zip(key_codes, self.radix):
+            code = code * radix + c
+        return code
+
+    def rows(self, **keys):
+        # row per query (-1 when the key isn't in the table), scalars broadcast against arrays
+        missing = [k for k in self.keys if k not in keys]
+        if len(missing) > 0:
+            raise ValueError(f"missing key(s) {missing}, this table is keyed by {self.keys}")
+        arrays = np.broadcast_arrays(*[np.asarray(keys[k], dtype=object) for k in self.keys])
+        key_codes = []
+        for k, values in zip(self.keys, arrays):
+            # only the distinct query values need normalizing
+            codes, uniques = pd.factorize(values.ravel())
+            level_codes = np.append(self.levels[k].get_indexer(key_strings(uniques)), -1)
+            key_codes.append(level_codes[codes])
+        known = np.logical_and.reduce([c >= 0 for c in key_codes])
+        code = self.composite(key_codes)
+        if self.dense is not None:
+            return np.where(known, self.dense[np.where(known, code, 0)], -1)
+        pos = np.minimum(np.searchsorted(self.codes, code), len(self.codes) - 1)
+        return np.where(known & (self.codes[pos] == code), pos, -1)
+
+    def ladder(self, metric):
+        if metric not in self.ladders:
+            raise ValueError(f"unknown metric {metric}, expected one of {self.metrics}")
+        return self.ladders[metric]
+
+    def percentile(self, metric, values, **keys):
+        # fraction of the ladder at or below each value, linearly interpolated between steps and clamped to [first step, 1]
+        ladders = self.ladder(metric)
+        values, rows = np.broadcast_arrays(np.asarray(values, dtype=np.float64), self.rows(**keys))
+        values = values.ravel()
+        rows = rows.ravel()
+        result = np.full(len(values), np.nan)
+        ok = (rows >= 0) & ~np.isnan(values) & ~np.isnan(ladders[np.maximum(rows, 0), 0])
+        r = rows[ok]
+        v = values[ok]
+
+        above = row_searchsorted(ladders, r, v)
+        width = ladders.shape[1]
+        lo = np.clip(above - 1, 0, width - 1)
+        hi = np.clip(above, 0, width - 1)
+        x_lo = ladders[r, lo]
+        x_hi = ladders[r, hi]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            frac = np.where(x_hi > x_lo, (v - x_lo) / (x_hi - x_lo), 0.0)
+        pct = self.pct[lo] + frac * (self.pct[hi] - self.pct[lo])
+        pct = np.where(above == 0, self.pct[0], pct)
+        pct = np.where(above == width, self.pct[-1], pct)
+        result[ok] = pct
+        return result
+
+    def value(self, metric, percentiles, **keys):
+        # ladder value at each percentile, linearly interpolated between steps and clamped to the ladder's ends
+        ladders = self.ladder(metric)
+        percentiles, rows = np.broadcast_arrays(np.asarray(percentiles, dtype=np.float64), self.rows(**keys))
+        percentiles = percentiles.ravel()
+        rows = rows.ravel()
+        result = np.full(len(percentiles), np.nan)
+        ok = (rows >= 0) & ~np.isnan(percentiles)
+        r = rows[ok]
+        p = np.clip(percentiles[ok], self.pct[0], self.pct[-1])
+
+        hi = np.clip(np.searchsorted(self.pct, p, side="left"), 1, len(self.pct) - 1)
+        lo = hi - 1
+        frac = (p - self.pct[lo]) / (self.pct[hi] - self.pct[lo])
+        x_lo = ladders[r, lo]
+        x_hi = ladders[r, hi]
+        result[ok] = x_lo + frac * (x_hi - x_lo)
+        return result
+
+def read_table(data_dir, name):
+    # every competition's copy of the table stacked together, tagged with the competition it came from
+    filename, keys, metrics = table_specs[name]
+    paths = {}
+    if "competition" in keys:
+        # only the known competitions, data/ also holds other folders (deltas/, ranks/) with same-named CSVs
+        for competition in sorted(c["competition"] for c in competitions):
+            paths[competition] = os.path.join(data_dir, competition, filename)
+        if name in top_level:
+            paths[top_level[name]] = os.path.join(data_dir, filename)
+    else:
+        paths[None] = os.path.join(data_dir, filename)
+    frames = []
+    for competition, path in sorted(paths.items(), key=lambda p: str(p[0])):
+        if os.path.isfile(path):
+            frame = pd.read_csv(path)
+            if competition is not None:
+                frame.insert(0, "competition", competition)
+            frames.append(frame)
+    if len(frames) == 0:
+        return None
+    return QuantileTable(pd.concat(frames, ignore_index=True), keys, metrics)
+
+def load_tables(data_dir = "./data"):
+    tables = {}
+    for name in table_specs.keys():
+        table = read_table(data_dir, name)
+        if table is not None:
+            print(f"Indexed {len(table)} {name} quantile ladders keyed by {table.keys}")
+            tables[name] = table
+    return tables
+
+def json_values(values):
+    return [None if np.isnan(v) else float(v) for v in values]
+
+def handle_query(tables, kind, query):
+    # query: { "table", "metric", "values" | "percentiles", and one scalar or list per key column }
+    if query.get("table") not in tables:
+        raise ValueError(f"unknown table {query.get('table')}, loaded tables are {list(tables.keys())}")
+    table = tables[query["table"]]
+    keys = { k : query[k] for k in table.keys if k in query }
+    if kind == "percentile":
+        return json_values(table.percentile(query.get("metric"), query.get("values", []), **keys))
+    return json_values(table.value(query.get("metric"), query.get("percentiles", []), **keys))
+
+def make_handler(tables):
+    class PercentileHandler(BaseHTTPRequestHandler):
+        # GET /percentile?table=season&metric=p96&competition=mls&season=2023&position=CB&action_type=Passing&values=0.1,0.2
+        # GET /value?table=zone&metric=net_p96&competition=mls&season=2023&zone=14&game_state=0&percentiles=0.5,0.9
+        # POST either path with the same fields as JSON, keys and values as lists for batches
+        def respond(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def answer(self, query):
+            kind = urlparse(self.path).path.strip("/")
+            if kind not in ["percentile", "value"]:
+                return self.respond(404, { "error" : "use /percentile or /value" })
+            try:
+                self.respond(200, { "results" : handle_query(tables, kind, query) })
+            except (ValueError, KeyError) as e:
+                self.respond(400, { "error" : str(e) })
+
+        def do_GET(self):
+            params = parse_qs(urlparse(self.path).query)
+            query = { k : (v[0].split(",") if len(v) == 1 else v) for k, v in params.items() }
+            for k in ["table", "metric"]:
+                if k in query:
+                    query[k] = query[k][0]
+            self.answer(query)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            try:
+                query = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError as e:
+                return self.respond(400, { "error" : f"invalid JSON body: {e}" })
+            self.answer(query)
+
+        def log_message(self, format, *args):
+            pass
+
+    return PercentileHandler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve value <-> percentile lookups over the published G+ quantile tables")
+    parser.add_argument("--data", default="./data", help="directory holding the percentile CSVs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    tables = load_tables(args.data)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(tables))
+    print(f"Serving percentile lookups for {list(tables.keys())} on http://{args.host}:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,76 @@
+import pandas as pd
+import numpy as np
+
+base_range = np.linspace(0.01, 1.00, 100)
+
+def key_codes(df, keys, order = None):
+    # integer code per row for each key, following the key's order of first appearance (or the given order)
+    order = order or {}
+    codes = []
+    uniques = []
+    for k in keys:
+        if k in order:
+            values = pd.Index(order[k])
+            codes.append(values.get_indexer(df[k]))
+            uniques.append(values)
+        else:
+            k_codes, k_uniques = pd.factorize(df[k])
+            codes.append(k_codes)
+            uniques.append(k_uniques)
+    return codes, uniques
+
+def quantile_ladder(sorted_values, starts, counts, q = base_range):
+    # same linear interpolation as Series.quantile / np.quantile, for every group at once
+    if len(sorted_values) == 0:
+        return np.full((len(counts), len(q)), np.nan)
+
+    n = counts[:, None]
+    virtual = (n - 1) * q[None, :]
+    prev = np.floor(virtual)
+    above = virtual >= n - 1
+    gamma = np.where(above, virtual + 1, virtual - prev)
+    prev = np.where(above, n - 1, prev)
+    nxt = np.where(above, n - 1, prev + 1)
+
+    # groups with no values index out of bounds here, they get blanked below
+    last = len(sorted_values) - 1
+    prev_idx = np.clip(starts[:, None] + prev, 0, last).astype(np.intp)
+    next_idx = np.clip(starts[:, None] + nxt, 0, last).astype(np.intp)
+
+    a = sorted_values[prev_idx]
+    b = sorted_values[next_idx]
+    with np.errstate(invalid="ignore"):
+        diff = b - a
+        ladder = a + diff * gamma
+        ladder = np.where(gamma >= 0.5, b - diff * (1 - gamma), ladder)
+    ladder[counts == 0] = np.nan
+    return ladder
+
+def group_quantiles(df, keys, values, q = base_range, order = None):
+    # one row per (group, q) with a quantile column for each of `values`, groups nested in `keys` order
+    codes, uniques = key_codes(df, keys, order)
+    valid = np.logical_and.reduce([c >= 0 for c in codes])
+    if not valid.any():
+        return pd.DataFrame()
+
+    stacked = np.column_stack([c[valid] for c in codes])
+    group_codes, group_ids = np.unique(stacked, axis=0, return_inverse=True)
+    group_ids = group_ids.ravel()
+    n_groups = len(group_codes)
+
+    result = {}
+    for i, k in enumerate(keys):
+        result[k] = np.repeat(uniques[i][group_codes[:, i]], len(q))
+    result["pct"] = np.tile(q, n_groups)
+
+    for v in values:
+        vals = df[v].to_numpy(dtype=np.float64)[valid]
+        present = ~np.isnan(vals)
+        ids = group_ids[present]
+        vals = vals[present]
+        sort_order = np.lexsort((vals, ids))
+        counts = np.bincount(ids, minlength=n_groups)
+        starts = np.cumsum(counts) - counts
+        result[v] = quantile_ladder(vals[sort_order], starts, counts, q).ravel()
+
+    return pd.DataFrame(result)
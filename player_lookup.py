@@ -5,26 +5,32 @@ import math
 import time
 import datetime
 import os
+import argparse
+
+from asa_api import AsaClient
+from parquet_store import write_outputs
+import membership_index
+from ranks_store import read_ranks
+
+client = AsaClient()
 
 def query_player_data(competition, player_ids):
-    player_data = []
-    chunks = np.array_split(player_ids, 50)
-    for i in range(0, len(chunks)):
-        time.sleep(1.25)
-        chunk = chunks[i]
+    chunks = [chunk for chunk in np.array_split(player_ids, 50) if len(chunk) > 0]
+    print(f"Grabbing player data using {len(chunks)} id chunks...")
+    urls = []
+    for chunk in chunks:
         id_list = ','.join(chunk)
-        print(f"Grabbing player data using ids chunk {i} of {len(chunks)}...")
-
-        tmp = pd.read_json(f"https://app.americansocceranalysis.com/api/v1/{competition}/players/xgoals?player_id={id_list}&split_by_teams=true&split_by_seasons=true")
-        if len(tmp) > 0:
-            tmp["competition"] = competition
-            player_data.append(tmp[["player_id", "competition", "season_name", "team_id"]])
+        urls.append(client.url(f"{competition}/players/xgoals", player_id=id_list, split_by_teams="true", split_by_seasons="true"))
+        urls.append(client.url(f"{competition}/goalkeepers/xgoals", player_id=id_list, split_by_teams="true", split_by_seasons="true"))
 
-        tmp = pd.read_json(f"https://app.americansocceranalysis.com/api/v1/{competition}/goalkeepers/xgoals?player_id={id_list}&split_by_teams=true&split_by_seasons=true")
+    player_data = []
+    for tmp in client.fetch_all(urls):
         if len(tmp) > 0:
             tmp["competition"] = competition
             player_data.append(tmp[["player_id", "competition", "season_name", "team_id"]])
     
+    if len(player_data) == 0:
+        return pd.DataFrame(columns=["player_id", "competition", "season_name", "team_id"])
     return pd.concat(player_data, axis=0)
 
 current_date_time = datetime.datetime.now()
@@ -65,32 +71,42 @@ competitions = [
     }
 ]
 
-big_dfs = []
-for c in competitions:
-    dfs = []
-    competition = c["competition"]
+def update_competition(index, resolved, competition):
     print(f"Retrieving player season data for {competition} from file system...")
-    tmp = pd.read_csv(f"./data/{competition}/player-g+-ranks.csv")
-    tmp["competition"] = competition
-    dfs.append(tmp[["player_id", "competition", "season_name", "team_id"]])
+    ranks = read_ranks(f"./data/{competition}")
+    index, added = membership_index.add_memberships(index, ranks, competition, "ranks")
+    print(f"Added {added} new memberships from the {competition} ranks")
 
-    # handle players left out of ranks because of minutes restrictions or other nonsense
+    # handle players left out of ranks because of minutes restrictions or other nonsense, but only ask ASA about ones we haven't resolved yet
     player_lookup = pd.read_csv(f"./data/{competition}/player_lookup.csv")
-    leftovers = player_lookup[~(player_lookup.player_id.isin(tmp.player_id))]
-    if len(leftovers) > 0:
-        print(f"Found {len(leftovers)} leftover players in the lookup table for {competition}")
+    leftovers = player_lookup[~(player_lookup.player_id.isin(ranks.player_id))]
+    unresolved = membership_index.players_to_resolve(index, resolved, competition, leftovers.player_id, year)
+    print(f"Found {len(leftovers)} leftover players in the lookup table for {competition}, {len(unresolved)} still to resolve")
+    if len(unresolved) > 0:
+        remaining = query_player_data(competition=competition, player_ids=unresolved)
+        index, added = membership_index.add_memberships(index, remaining, competition, "xgoals")
+        resolved = membership_index.mark_resolved(resolved, competition, unresolved, year)
+        print(f"Added {added} new memberships for {len(unresolved)} resolved {competition} players")
 
-        remaining = query_player_data(competition=competition, player_ids=leftovers.player_id.tolist())
-        dfs.append(remaining)
-    
-    b_df = pd.concat(dfs, axis = 0)
-    b_df = pd.merge(b_df, player_lookup, on = "player_id")
-    big_dfs.append(b_df)
+    return index, resolved, player_lookup
+
+def main(rebuild = False):
+    index = membership_index.empty_index() if rebuild else membership_index.load_index()
+    resolved = membership_index.empty_resolved() if rebuild else membership_index.load_resolved()
+    print(f"Loaded membership index with {len(index)} memberships and {len(resolved)} resolved players")
+
+    names = {}
+    for c in competitions:
+        index, resolved, names[c["competition"]] = update_competition(index, resolved, c["competition"])
+    membership_index.save(index, resolved)
+
+    print(f"assembling player season table based on data from ASA...")
+    player_df = membership_index.player_lookup(index, names, [c["competition"] for c in competitions])
+    write_outputs(player_df, "./data/player_lookup.csv", "season_player_lookup", season_column="season_name")
+    print(f"Wrote {len(player_df)} player seasons from a membership index of {len(index)}")
 
-print(f"assembling player season table based on data from ASA...")
-player_df = pd.concat(big_dfs, axis=0)
-player_df["season_name"] = player_df["season_name"].astype(str)
-player_df["season_name"] = player_df["season_name"].str.replace(".0", "")
-player_df = player_df[(player_df.team_id != "All") & (player_df.player_name != "")].drop_duplicates(["player_id", "competition", "season_name", "team_id"])
-player_df[["competition", "season_name", "team_id", "player_id", "player_name"]].to_csv("./data/player_lookup.csv",index=False)
-    
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the player membership index and regenerate data/player_lookup.csv")
+    parser.add_argument("--rebuild", action="store_true", help="ignore the saved index and re-resolve every leftover player")
+    args = parser.parse_args()
+    main(args.rebuild)
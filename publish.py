@@ -0,0 +1,162 @@
+import pandas as pd
+import numpy as np
+import os
+import io
+import json
+import fcntl
+import hashlib
+import datetime
+from contextlib import contextmanager
+
+# per published CSV: content hash, rows and a hash per season partition, plus the delta file for its last change
+manifest_path = "./data/manifest.json"
+delta_root = "./data/deltas"
+
+# columns identifying a row of each table, so a delta can tell changed rows from added/removed ones (other tables use their non-float columns plus pct)
+delta_keys = {
+    "season-g+-pct" : ["position", "action_type", "season", "pct"],
+    "player-g+-pct" : ["position", "season", "pct"],
+    "player_lookup" : ["player_id"],
+    "player-g+-ranks" : ["season_name", "team_id", "position", "action_type", "rank_type", "player_id"],
+    "team_position_breakdown" : ["season_name", "team_id", "general_position"],
+    "team-g+-zones" : ["season_name", "team_id", "zone", "game_state", "data.action_type"],
+    "percentile-g+-zones" : ["season", "zone", "game_state", "pct"],
+    "season_player_lookup" : ["competition", "season_name", "team_id", "player_id"],
+    "team_lookup" : ["competition", "season_name", "team_id"],
+    "game-g+-pct" : ["position", "season", "pct"],
+    "form-g+-pct" : ["position", "season", "window", "pct"],
+    "form-g+-ranks" : ["season", "position", "rank_type", "player_id"],
+    "similar-players" : ["season_name", "player_id", "general_position", "rank"],
+}
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def file_hash(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+def partition_labels(df, season_column):
+    if season_column is None or season_column not in df.columns:
+        return pd.Series("all", index=df.index)
+    return df[season_column].astype(str)
+
+def partition_hashes(text, parsed, season_column):
+    # hash of each partition's CSV lines, in file order, so it only moves when that partition's rows do
+    lines = text.splitlines(keepends=True)[1:]
+    labels = partition_labels(parsed, season_column)
+    if len(lines) != len(parsed):
+        # quoted newlines inside values, fall back to re-rendering each partition
+        return { p : text_hash(parsed[labels == p].to_csv(index=False)) for p in pd.unique(labels) }
+    grouped = pd.Series(lines, dtype=object).groupby(labels.to_numpy(), sort=False)
+    return { p : hashlib.sha256("".join(rows).encode("utf-8")).hexdigest() for p, rows in grouped }
+
+def row_keys(table, df):
+    keys = delta_keys.get(table) or [c for c in df.columns if not pd.api.types.is_float_dtype(df[c])] + (["pct"] if "pct" in df.columns else [])
+    return [k for k in keys if k in df.columns]
+
+def row_delta(table, old, new):
+    # added/changed rows with their new values and removed rows with their old ones, keyed by row_keys (plus an occurrence number for repeated keys)
+    keys = row_keys(table, new if len(new.columns) > 0 else old)
+    if not set(keys).issubset(old.columns) or not set(keys).issubset(new.columns):
+        # the file's layout changed, every old row goes and every new one comes in
+        delta = pd.concat([old.assign(change="removed"), new.assign(change="added")], ignore_index=True)
+        return delta[["change"] + [c for c in delta.columns if c != "change"]]
+    old = old.assign(_n=old.groupby(keys, dropna=False, sort=False).cumcount())
+    new = new.assign(_n=new.groupby(keys, dropna=False, sort=False).cumcount())
+    merged = old.merge(new, on=keys + ["_n"], how="outer", suffixes=("_old", ""), indicator=True)
+    values = [c for c in new.columns if c not in keys + ["_n"]]
+
+    changed = pd.Series(False, index=merged.index)
+    for c in values:
+        if f"{c}_old" not in merged.columns:
+            continue
+        a = merged[f"{c}_old"]
+        b = merged[c]
+        changed |= ~((a == b) | (a.isna() & b.isna()))
+    merged["change"] = np.where(merged["_merge"] == "right_only", "added", np.where(merged["_merge"] == "left_only", "removed", np.where(changed, "changed", "")))
+    for c in values:
+        if f"{c}_old" in merged.columns:
+            merged[c] = merged[c].where(merged["change"] != "removed", merged[f"{c}_old"])
+    delta = merged[merged["change"] != ""]
+    return delta[["change"] + keys + values]
+
+def repo_path(path):
+    # how paths are written in the manifest: relative to the repo root, no leading ./
+    return os.path.normpath(path)
+
+def delta_path(csv_path):
+    # data/mls/season-g+-pct.csv -> data/deltas/mls/season-g+-pct.csv
+    relative = os.path.relpath(csv_path, os.path.dirname(manifest_path))
+    return repo_path(os.path.join(delta_root, relative))
+
+def write_delta(delta, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    delta.to_csv(path, index=False)
+
+def empty_delta(table, df):
+    # header-only delta for a run that changed nothing; the pushed repo never drops files, so the last delta has to be overwritten rather than deleted
+    keys = row_keys(table, df)
+    return pd.DataFrame(columns=["change"] + keys + [c for c in df.columns if c not in keys])
+
+@contextmanager
+def locked_manifest():
+    # the build graph writes from several processes at once, so the manifest is read-modified-written under an exclusive lock
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = json.load(open(manifest_path)) if os.path.exists(manifest_path) else {}
+        yield manifest
+        with open(manifest_path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+def publish_csv(df, csv_path, table, competition = None, season_column = None):
+    # writes df to csv_path unless its content is unchanged; returns (changed partitions, removed partitions), both empty when nothing changed
+    text = df.to_csv(index=False)
+    digest = text_hash(text)
+    key = repo_path(csv_path)
+    with locked_manifest() as manifest:
+        entry = manifest.get(key)
+        if entry is not None and entry["hash"] == digest and file_hash(csv_path) == digest:
+            delta_file = delta_path(csv_path)
+            if entry.get("changed") or entry.get("removed") or not os.path.exists(delta_file):
+                write_delta(empty_delta(table, df), delta_file)
+            entry.update({ "changed" : [], "removed" : [], "delta" : delta_file })
+            print(f"{csv_path} is unchanged, skipped writing it")
+            return [], []
+
+        parsed = pd.read_csv(io.StringIO(text), float_precision="round_trip") if len(df.columns) > 0 else pd.DataFrame()
+        partitions = partition_hashes(text, parsed, season_column) if len(df.columns) > 0 else {}
+        previous = entry["partitions"] if entry is not None else {}
+        changed = [p for p, h in partitions.items() if previous.get(p) != h]
+        removed = [p for p in previous.keys() if p not in partitions]
+
+        # row level delta for the partitions that moved, against what's on disk now
+        delta_file = None
+        if len(parsed.columns) > 0:
+            old = pd.read_csv(csv_path, float_precision="round_trip") if os.path.exists(csv_path) and os.path.getsize(csv_path) > 1 else parsed.iloc[0:0]
+            old = old[partition_labels(old, season_column).isin(changed + removed).to_numpy()]
+            new = parsed[partition_labels(parsed, season_column).isin(changed).to_numpy()]
+            delta_file = delta_path(csv_path)
+            write_delta(row_delta(table, old, new), delta_file)
+
+        with open(csv_path + ".tmp", "w") as f:
+            f.write(text)
+        os.replace(csv_path + ".tmp", csv_path)
+        manifest[key] = {
+            "table" : table,
+            "competition" : competition,
+            "season_column" : season_column,
+            "hash" : digest,
+            "rows" : len(df),
+            "partitions" : partitions,
+            "changed" : changed,
+            "removed" : removed,
+            "delta" : delta_file,
+            "updated" : datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+    print(f"Wrote {csv_path}: {len(changed)} of {len(partitions)} partitions changed, {len(removed)} removed")
+    return changed, removed
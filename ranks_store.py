@@ -0,0 +1,94 @@
+import pandas as pd
+import numpy as np
+import os
+
+from leaderboards import leaderboard_size
+
+board_keys = ["season_name", "team_id", "position", "action_type", "rank_type"]
+# one slot of a top 10; player is a row of the competition's player_lookup.csv (-1 pads boards with fewer entries), p96 is recomputed from total/minutes
+slot_dtype = np.dtype([("player", "<i4"), ("total", "<f8"), ("minutes_played", "<f8"), ("total_rank", "<f4"), ("p96_rank", "<f4")])
+
+def ranks_dir(base_path):
+    return f"{base_path}/ranks"
+
+def write_ranks(ranks, lookup, base_path):
+    # ranks: the long player-g+-ranks frame (each board's rows contiguous), lookup: player_lookup.csv as written
+    directory = ranks_dir(base_path)
+    os.makedirs(directory, exist_ok=True)
+    keys = ranks[board_keys].astype(str)
+    new_board = np.concatenate([[True], (keys.to_numpy()[1:] != keys.to_numpy()[:-1]).any(axis=1)]) if len(ranks) > 0 else np.array([], dtype=bool)
+    board = np.cumsum(new_board) - 1
+    starts = np.nonzero(new_board)[0]
+    slot = np.arange(len(ranks)) - starts[board]
+
+    boards = keys[new_board].reset_index(drop=True)
+    boards["length"] = np.bincount(board, minlength=len(boards)) if len(ranks) > 0 else []
+    slots = np.zeros((len(boards), leaderboard_size), dtype=slot_dtype)
+    slots["player"] = -1
+    for field in ["total", "minutes_played", "total_rank", "p96_rank"]:
+        slots[field] = np.nan
+    slots["player"][board, slot] = pd.Index(lookup["player_id"].astype(str)).get_indexer(ranks["player_id"].astype(str))
+    slots["total"][board, slot] = ranks["total"].to_numpy(dtype=np.float64)
+    slots["minutes_played"][board, slot] = ranks["minutes_played"].to_numpy(dtype=np.float64)
+    slots["total_rank"][board, slot] = ranks["total_rank"].to_numpy(dtype=np.float64)
+    slots["p96_rank"][board, slot] = ranks["p96_rank"].to_numpy(dtype=np.float64)
+
+    boards.to_csv(f"{directory}/boards.csv", index_label="board")
+    np.save(f"{directory}/ranks.npy", slots)
+    return len(boards)
+
+class RankStore:
+    # the board key table in memory, the top 10 slots memory-mapped, so any one leaderboard is a dict lookup plus one row read
+    def __init__(self, base_path):
+        directory = ranks_dir(base_path)
+        self.boards = pd.read_csv(f"{directory}/boards.csv", dtype=str, keep_default_na=False)
+        self.lengths = self.boards["length"].astype(np.int64).to_numpy()
+        self.index = { key : i for i, key in enumerate(self.boards[board_keys].itertuples(index=False, name=None)) }
+        self.slots = np.load(f"{directory}/ranks.npy", mmap_mode="r")
+        self.players = pd.read_csv(f"{base_path}/player_lookup.csv", dtype=str, keep_default_na=False)
+
+    def __len__(self):
+        return len(self.boards)
+
+    def rows(self, boards):
+        # the long player-g+-ranks rows for these board numbers, in board order
+        boards = np.asarray(boards, dtype=np.int64)
+        lengths = self.lengths[boards]
+        board = np.repeat(boards, lengths)
+        slot = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        slots = self.slots[board, slot]
+        keys = self.boards.iloc[board]
+        players = self.players.iloc[slots["player"]]
+        total = slots["total"].astype(np.float64)
+        minutes = slots["minutes_played"].astype(np.float64)
+        return pd.DataFrame({
+            "season_name" : keys["season_name"].to_numpy(),
+            "player_id" : players["player_id"].to_numpy(),
+            "data.goals_added_raw" : total,
+            "minutes_played" : minutes,
+            "total" : total,
+            "total_rank" : slots["total_rank"].astype(np.float64),
+            "p96" : total * 96 / minutes,
+            "p96_rank" : slots["p96_rank"].astype(np.float64),
+            "team_id" : keys["team_id"].to_numpy(),
+            "position" : keys["position"].to_numpy(),
+            "action_type" : keys["action_type"].to_numpy(),
+            "rank_type" : keys["rank_type"].to_numpy(),
+            "player_name" : players["player_name"].to_numpy(),
+        })
+
+    def board(self, season_name, team_id = "All", position = "All", action_type = "All", rank_type = "p96"):
+        # one leaderboard, None when there's no such board
+        i = self.index.get((str(season_name), team_id, position, action_type, rank_type))
+        if i is None:
+            return None
+        return self.rows([i])
+
+    def all_rows(self):
+        return self.rows(np.arange(len(self.boards)))
+
+def read_ranks(base_path):
+    # every board as the long player-g+-ranks table, from the normalized files when there are any, else the CSV
+    if os.path.exists(f"{ranks_dir(base_path)}/ranks.npy"):
+        return RankStore(base_path).all_rows()
+    return pd.read_csv(f"{base_path}/player-g+-ranks.csv")
@@ -4,6 +4,8 @@ import json
 import time
 import datetime
 
+from asa_api import AsaClient
+
 current_date_time = datetime.datetime.now()
 year = current_date_time.date().strftime("%Y")
 year = int(year)
@@ -11,16 +13,15 @@ year = int(year)
 leagues = ["mls", "nwsl", "uslc", "usls", "mlsnp", "usl1"]
 league_teams = []
 
-for l in leagues:
-    print(f"load {l} team data for year {year}")
-    url = f"https://app.americansocceranalysis.com/api/v1/{l}/teams/goals-added?season_name={year}"
-    tmp = pd.read_json(url)
+client = AsaClient()
 
-    print(f"found {len(tmp)} teams for year {year}")
-    team_id_str = ",".join(tmp["team_id"].tolist())
-    league_url = f"https://app.americansocceranalysis.com/api/v1/{l}/teams?team_id={team_id_str}"
+print(f"load team data for year {year} in {len(leagues)} leagues")
+team_frames = client.fetch_all([client.url(f"{l}/teams/goals-added", season_name=year) for l in leagues])
+for l, tmp in zip(leagues, team_frames):
+    print(f"found {len(tmp)} {l} teams for year {year}")
 
-    league = pd.read_json(league_url)
+league_urls = [client.url(f"{l}/teams", team_id=",".join(tmp["team_id"].tolist())) for tmp in team_frames]
+for l, league in zip(leagues, client.fetch_all(league_urls)):
     league["competition"] = l
     league_teams.append(league)
 
@@ -0,0 +1,163 @@
+import pandas as pd
+import numpy as np
+import os
+import glob
+import argparse
+
+from leaderboards import eligible_rows
+from gplus_schema import save_snapshot, load_snapshot
+
+profile_root = "./snapshots/similarity"
+default_k = 10
+# query rows per matrix product, bounds the (block x player-seasons) similarity slab held at once
+block_size = 2048
+label_columns = ["competition", "season", "season_name", "player_id", "general_position", "group"]
+
+def profile_path(competition):
+    return f"{profile_root}/{competition}.pkl"
+
+def player_profiles(base, competition):
+    # one row per eligible player-season: its p96 in every action type, standardized within the competition/season/(GK or field) pool and scaled to unit length
+    rows = eligible_rows(base)
+    keys = ["season", "season_name", "player_id", "general_position"]
+    if len(rows) == 0:
+        return pd.DataFrame(columns=label_columns)
+    # minutes like total_percentiles: the player-season's mean over its rows
+    minutes = rows.groupby(keys, observed=True)["minutes_played"].mean()
+    totals = rows.pivot_table(index=keys, columns="data.action_type", values="data.goals_added_raw", aggfunc="sum", fill_value=0.0, observed=True)
+    totals = totals.reindex(minutes.index, fill_value=0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p96 = totals.to_numpy(dtype=np.float64) * 96 / minutes.to_numpy()[:, None]
+    p96 = np.nan_to_num(p96, nan=0.0, posinf=0.0, neginf=0.0)
+
+    labels = minutes.index.to_frame(index=False)
+    labels.insert(0, "competition", competition)
+    labels["season_name"] = labels["season_name"].astype(str).str.replace(".0", "")
+    labels["player_id"] = labels["player_id"].astype(str)
+    labels["general_position"] = labels["general_position"].astype(str)
+    # keepers and outfield players have different action types, they only get compared among themselves
+    labels["group"] = np.where(labels["general_position"] == "GK", "GK", "field")
+
+    pool = labels.groupby(["season", "group"], sort=False).ngroup().to_numpy()
+    counts = np.bincount(pool)[:, None]
+    means = np.zeros((counts.shape[0], p96.shape[1]))
+    squares = np.zeros((counts.shape[0], p96.shape[1]))
+    np.add.at(means, pool, p96)
+    means /= counts
+    np.add.at(squares, pool, (p96 - means[pool]) ** 2)
+    std = np.sqrt(squares / counts)
+    scaled = np.where(std[pool] > 0, (p96 - means[pool]) / np.where(std[pool] > 0, std[pool], 1), 0.0)
+    norms = np.linalg.norm(scaled, axis=1, keepdims=True)
+    scaled = np.where(norms > 0, scaled / np.where(norms > 0, norms, 1), 0.0)
+
+    profile = pd.DataFrame(scaled, columns=[str(c) for c in totals.columns])
+    return pd.concat([labels, profile], axis=1)
+
+class SimilarityIndex:
+    # unit-length profiles stacked per group, so cosine similarity against everyone is one float32 matrix product
+    def __init__(self, profiles):
+        self.labels = profiles[label_columns].reset_index(drop=True)
+        actions = sorted(c for c in profiles.columns if c not in label_columns)
+        # profiles from different competitions can list different action types, missing ones are 0 (the pool average)
+        self.actions = actions
+        self.matrix = profiles.reindex(columns=actions).fillna(0.0).to_numpy(dtype=np.float32)
+        self.groups = { g : np.nonzero(self.labels["group"].to_numpy() == g)[0] for g in pd.unique(self.labels["group"]) }
+
+    def __len__(self):
+        return len(self.labels)
+
+    def top_k(self, rows, k = default_k, exclude_same_player = True):
+        # (neighbour rows, similarities) of shape (len(rows), k) for these rows of the index, best first, -1/NaN where a group has fewer candidates
+        rows = np.asarray(rows, dtype=np.int64)
+        neighbours = np.full((len(rows), k), -1, dtype=np.int64)
+        similarities = np.full((len(rows), k), np.nan, dtype=np.float32)
+        players = self.labels["player_id"].to_numpy()
+        group_of = self.labels["group"].to_numpy()
+        for group, members in self.groups.items():
+            which = np.nonzero(group_of[rows] == group)[0]
+            candidates = self.matrix[members]
+            for start in range(0, len(which), block_size):
+                block = which[start:start + block_size]
+                sims = self.matrix[rows[block]] @ candidates.T
+                # never your own row, and by default none of your other seasons either
+                if exclude_same_player:
+                    sims[players[rows[block]][:, None] == players[members][None, :]] = -np.inf
+                else:
+                    sims[rows[block][:, None] == members[None, :]] = -np.inf
+                kk = min(k, len(members))
+                top = np.argpartition(-sims, kk - 1, axis=1)[:, :kk] if kk < len(members) else np.tile(np.arange(len(members)), (len(block), 1))
+                top_sims = np.take_along_axis(sims, top, axis=1)
+                order = np.argsort(-top_sims, axis=1, kind="stable")
+                top = np.take_along_axis(top, order, axis=1)
+                top_sims = np.take_along_axis(top_sims, order, axis=1)
+                found = np.isfinite(top_sims)
+                neighbours[block, :kk] = np.where(found, members[top], -1)
+                similarities[block, :kk] = np.where(found, top_sims, np.nan)
+        return neighbours, similarities
+
+    def neighbour_table(self, rows = None, k = default_k):
+        # long table of each row's k nearest player-seasons
+        rows = np.arange(len(self.labels)) if rows is None else np.asarray(rows, dtype=np.int64)
+        neighbours, similarities = self.top_k(rows, k)
+        source = np.repeat(rows, k)
+        target = neighbours.ravel()
+        keep = target >= 0
+        source, target = source[keep], target[keep]
+        table = pd.DataFrame({
+            "season_name" : self.labels["season_name"].to_numpy()[source],
+            "player_id" : self.labels["player_id"].to_numpy()[source],
+            "general_position" : self.labels["general_position"].to_numpy()[source],
+            "rank" : np.tile(np.arange(1, k + 1), len(rows))[keep],
+            "neighbour_competition" : self.labels["competition"].to_numpy()[target],
+            "neighbour_season_name" : self.labels["season_name"].to_numpy()[target],
+            "neighbour_id" : self.labels["player_id"].to_numpy()[target],
+            "neighbour_position" : self.labels["general_position"].to_numpy()[target],
+            "similarity" : similarities.ravel()[keep].astype(np.float64).round(4),
+        })
+        if self.labels["competition"].nunique() > 1:
+            table.insert(0, "competition", self.labels["competition"].to_numpy()[source])
+        return table
+
+    def find(self, player_id, season_name = None, competition = None):
+        match = self.labels["player_id"] == str(player_id)
+        if season_name is not None:
+            match &= self.labels["season_name"] == str(season_name)
+        if competition is not None:
+            match &= self.labels["competition"] == competition
+        return np.nonzero(match.to_numpy())[0]
+
+    def similar(self, player_id, season_name = None, competition = None, k = default_k):
+        # nearest player-seasons to each of the player's seasons (or the one asked for)
+        rows = self.find(player_id, season_name, competition)
+        if len(rows) == 0:
+            return pd.DataFrame()
+        return self.neighbour_table(rows, k)
+
+def save_profiles(profiles, competition):
+    save_snapshot(profiles, profile_path(competition))
+
+def load_index(competitions = None):
+    # one index over the stored profiles of these competitions (all of them by default), for cross-competition queries
+    paths = sorted(glob.glob(profile_path("*")))
+    frames = [load_snapshot(p) for p in paths if competitions is None or os.path.basename(p)[:-4] in competitions]
+    frames = [f for f in frames if f is not None and len(f) > 0]
+    if len(frames) == 0:
+        return None
+    return SimilarityIndex(pd.concat(frames, ignore_index=True))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find the most similar player-seasons by per-action G+ profile, across seasons and competitions")
+    parser.add_argument("player_id")
+    parser.add_argument("--season", help="only this season of the player's (season_name, e.g. 2023 or 2024-25)")
+    parser.add_argument("--competition", action="append", help="search only these competitions' profiles (repeatable), defaults to every stored one")
+    parser.add_argument("-k", type=int, default=default_k)
+    args = parser.parse_args()
+
+    index = load_index(args.competition)
+    if index is None:
+        raise SystemExit("No player profiles stored, run asa_retrieve.py first")
+    print(f"Searching {len(index)} player-seasons over {len(index.actions)} action types...")
+    result = index.similar(args.player_id, args.season, k=args.k)
+    if len(result) == 0:
+        raise SystemExit(f"{args.player_id} has no eligible player-season in the stored profiles")
+    print(result.to_string(index=False))
@@ -0,0 +1,252 @@
+import pandas as pd
+import numpy as np
+import os
+import math
+import argparse
+
+from percentiles import base_range, key_codes
+from parquet_store import write_outputs
+from zone_tensor import output_dir
+from gplus_schema import save_snapshot, load_snapshot
+
+sketch_root = "./snapshots/sketches"
+# target rank error of a sketch quantile, 0.005 = within half a percentile step
+default_error = 0.005
+
+def compression_for(error):
+    # t-digest (k1 scale) centroids span at most pi / compression of the rank around the median, interpolating inside one halves that
+    return int(math.ceil(math.pi / (2 * error)))
+
+def compress(ids, means, weights, compression):
+    # one t-digest pass over centroids sorted by (sketch id, mean): neighbours falling in the same k1 scale bucket get merged
+    if len(ids) == 0:
+        return ids, means, weights
+    totals = np.bincount(ids, weights=weights)
+    before = np.cumsum(weights) - weights
+    group_before = np.cumsum(totals) - totals
+    q = (before - group_before[ids] + weights / 2) / totals[ids]
+    k = np.floor(compression / (2 * np.pi) * np.arcsin(np.clip(2 * q - 1, -1, 1)))
+    boundary = np.concatenate([[True], (ids[1:] != ids[:-1]) | (k[1:] != k[:-1])])
+    cluster = np.cumsum(boundary) - 1
+    merged_weights = np.bincount(cluster, weights=weights)
+    merged_means = np.bincount(cluster, weights=weights * means) / merged_weights
+    # a centroid is never wider than its values, rounding in the weighted mean can't push it outside them
+    merged_means = np.clip(merged_means, np.minimum.reduceat(means, np.nonzero(boundary)[0]), np.maximum.reduceat(means, np.nonzero(boundary)[0]))
+    return ids[boundary], merged_means, merged_weights
+
+class SketchSet:
+    # one t-digest per (key tuple, metric): `index` holds the keys plus count/min/max and where its centroids sit in the flat means/weights arrays
+    def __init__(self, index, means, weights, keys, compression):
+        self.index = index.reset_index(drop=True)
+        self.means = means
+        self.weights = weights
+        self.keys = keys
+        self.compression = compression
+
+    def __len__(self):
+        return len(self.index)
+
+    @classmethod
+    def from_centroids(cls, labels, ids, means, weights, keys, compression):
+        # labels: one row per sketch id (keys + metric), centroids sorted by (id, mean), labels without centroids are dropped
+        n = len(labels)
+        first = np.concatenate([[True], ids[1:] != ids[:-1]]) if len(ids) > 0 else np.array([], dtype=bool)
+        last = np.concatenate([ids[1:] != ids[:-1], [True]]) if len(ids) > 0 else np.array([], dtype=bool)
+        low = means[first]
+        high = means[last]
+        ids, means, weights = compress(ids, means, weights, compression)
+        lengths = np.bincount(ids, minlength=n)
+        present = lengths > 0
+        index = labels[present].copy()
+        index["count"] = np.bincount(ids, weights=weights, minlength=n)[present]
+        index["length"] = lengths[present]
+        index["start"] = np.cumsum(lengths[present]) - lengths[present]
+        # the extreme centroids may already average several values, min/max keep the real ends
+        index["min"] = low
+        index["max"] = high
+        return cls(index, means, weights, keys, compression)
+
+    def sketch_ids(self):
+        return np.repeat(np.arange(len(self.index)), self.index["length"].to_numpy())
+
+    def select(self, mask):
+        mask = np.asarray(mask, dtype=bool)
+        keep = np.repeat(mask, self.index["length"].to_numpy())
+        index = self.index[mask].copy()
+        index["start"] = np.cumsum(index["length"].to_numpy()) - index["length"].to_numpy()
+        return SketchSet(index, self.means[keep], self.weights[keep], self.keys, self.compression)
+
+    def merge(self, by, compression = None):
+        # merged sketch per distinct `by` (a subset of the keys, or columns added to `index`) and metric, e.g. by=["position"] for careers
+        compression = compression or self.compression
+        if len(self.index) == 0:
+            return SketchSet(self.index[by + ["metric"]].copy(), self.means, self.weights, by, compression)
+        group_columns = by + ["metric"]
+        codes, uniques = key_codes(self.index, group_columns)
+        group_codes, groups = np.unique(np.column_stack(codes), axis=0, return_inverse=True)
+        groups = groups.ravel()
+        labels = pd.DataFrame({ k : uniques[i][group_codes[:, i]] for i, k in enumerate(group_columns) })
+
+        ids = groups[self.sketch_ids()]
+        order = np.lexsort((self.means, ids))
+        merged = SketchSet.from_centroids(labels, ids[order], self.means[order], self.weights[order], by, compression)
+        # merged extremes come from the inputs' own min/max rather than their extreme centroids
+        merged.index["min"] = pd.Series(self.index["min"].to_numpy()).groupby(groups).min().to_numpy()
+        merged.index["max"] = pd.Series(self.index["max"].to_numpy()).groupby(groups).max().to_numpy()
+        return merged
+
+    def quantiles(self, q = base_range):
+        # (sketches x q) values: rank q * (count - 1) between the centroid centres, anchored on each sketch's min and max
+        n = len(self.index)
+        if n == 0:
+            return np.empty((0, len(q)))
+        counts = self.index["count"].to_numpy()
+        lengths = self.index["length"].to_numpy()
+        starts = self.index["start"].to_numpy()
+        sketch = self.sketch_ids()
+        offsets = np.cumsum(counts) - counts
+
+        # every sketch laid out along one global rank axis, [min] + centroids + [max] with 2 extra points per sketch
+        centres = np.cumsum(self.weights) - self.weights / 2
+        points = np.arange(len(self.means)) + 2 * sketch + 1
+        x = np.empty(len(self.means) + 2 * n)
+        y = np.empty(len(self.means) + 2 * n)
+        x[points] = centres
+        y[points] = self.means
+        first = starts + 2 * np.arange(n)
+        last = starts + lengths + 2 * np.arange(n) + 1
+        x[first] = offsets + 0.5
+        y[first] = self.index["min"].to_numpy()
+        x[last] = offsets + counts - 0.5
+        y[last] = self.index["max"].to_numpy()
+
+        ranks = offsets[:, None] + 0.5 + (counts[:, None] - 1) * q[None, :]
+        return np.interp(ranks.ravel(), x, y).reshape(n, len(q))
+
+    def quantile_table(self, q = base_range):
+        # one row per (key tuple, q) with a column per metric, like group_quantiles
+        if len(self.index) == 0:
+            return pd.DataFrame()
+        ladder = self.quantiles(q)
+        long = self.index[self.keys + ["metric"]].loc[self.index.index.repeat(len(q))].reset_index(drop=True)
+        long["pct"] = np.tile(q, len(self.index))
+        long["value"] = ladder.ravel()
+        table = long.set_index(self.keys + ["pct", "metric"])["value"].unstack("metric").reset_index()
+        table.columns.name = None
+        return table
+
+def build_sketches(df, keys, values, compression):
+    # one sketch per (group of `keys`, column of `values`), NaN values left out
+    codes, uniques = key_codes(df, keys)
+    valid = np.logical_and.reduce([c >= 0 for c in codes])
+    if not valid.any():
+        return SketchSet(pd.DataFrame(columns=keys + ["metric"]), np.array([]), np.array([]), keys, compression)
+    group_codes, groups = np.unique(np.column_stack([c[valid] for c in codes]), axis=0, return_inverse=True)
+    groups = groups.ravel()
+    n_groups = len(group_codes)
+    group_labels = pd.DataFrame({ k : uniques[i][group_codes[:, i]] for i, k in enumerate(keys) })
+
+    labels = []
+    ids = []
+    vals = []
+    for m, column in enumerate(values):
+        v = df[column].to_numpy(dtype=np.float64)[valid]
+        present = ~np.isnan(v)
+        labels.append(group_labels.assign(metric=column))
+        ids.append(groups[present] + m * n_groups)
+        vals.append(v[present])
+    labels = pd.concat(labels, ignore_index=True)
+    ids = np.concatenate(ids)
+    vals = np.concatenate(vals)
+    order = np.lexsort((vals, ids))
+    return SketchSet.from_centroids(labels, ids[order], vals[order], np.ones(len(vals)), keys, compression)
+
+def concat_sketches(sets):
+    # stack sketch sets with the same keys (e.g. one per competition) into one
+    sets = [s for s in sets if len(s) > 0]
+    index = pd.concat([s.index for s in sets], ignore_index=True)
+    index["start"] = np.cumsum(index["length"].to_numpy()) - index["length"].to_numpy()
+    return SketchSet(index, np.concatenate([s.means for s in sets]), np.concatenate([s.weights for s in sets]), sets[0].keys, max(s.compression for s in sets))
+
+def sketch_path(name):
+    return f"{sketch_root}/{name}.pkl"
+
+def save_sketches(sets, name):
+    path = sketch_path(name)
+    save_snapshot(sets, path)
+
+def load_sketches(name):
+    return load_snapshot(sketch_path(name))
+
+def season_windows(sketch_set, seasons, season_column = "season"):
+    # every run of `seasons` consecutive seasons (or all of them when seasons is None) as one merged set, labelled by its first/last season
+    years = sorted(pd.unique(sketch_set.index[season_column].astype(np.int64)))
+    if seasons is None:
+        windows = [(years[0], years[-1])] if len(years) > 0 else []
+    else:
+        windows = [(yr - seasons + 1, yr) for yr in years if yr - seasons + 1 >= years[0]]
+    by = [k for k in sketch_set.keys if k != season_column]
+    merged = []
+    for first, last in windows:
+        in_window = sketch_set.index[season_column].astype(np.int64).between(first, last).to_numpy()
+        window = sketch_set.select(in_window).merge(by)
+        window.index.insert(0, "first_season", first)
+        window.index.insert(1, "last_season", last)
+        window.keys = ["first_season", "last_season"] + by
+        merged.append(window)
+    return merged
+
+def window_table(sketch_set, seasons, columns, season_column = "season"):
+    tables = [w.quantile_table() for w in season_windows(sketch_set, seasons, season_column)]
+    tables = [t for t in tables if len(t) > 0]
+    if len(tables) == 0:
+        return pd.DataFrame()
+    table = pd.concat(tables, ignore_index=True)
+    # keys, pct, then the metrics in the order they were sketched
+    metrics = pd.unique(sketch_set.index["metric"]).tolist()
+    table = table[[c for c in table.columns if c not in metrics] + metrics]
+    return table.rename(columns=columns)
+
+def write_windows(competition, seasons):
+    # career (seasons=None) or rolling `seasons` season percentiles, straight from the stored sketches
+    sets = load_sketches(competition)
+    if sets is None:
+        print(f"No sketches stored for {competition}, run asa_retrieve.py --sketches first")
+        return
+    suffix = "career" if seasons is None else f"{seasons}yr"
+    base_path = f"./data/{competition}"
+    os.makedirs(base_path, exist_ok=True)
+
+    action = window_table(sets["action"], seasons, { "general_position" : "position", "data.action_type" : "action_type", "data.goals_added_raw_p96" : "p96", "data.goals_added_raw" : "pSzn" })
+    write_outputs(action, f"{base_path}/{suffix}-g+-pct.csv", f"{suffix}-g+-pct", competition, "last_season")
+    player = window_table(sets["player"], seasons, { "general_position" : "position", "p96" : "p96", "total" : "pSzn" })
+    write_outputs(player, f"{base_path}/{suffix}-player-g+-pct.csv", f"{suffix}-player-g+-pct", competition, "last_season")
+    print(f"Wrote {len(action)} {suffix} action percentiles and {len(player)} {suffix} player percentiles for {competition} from sketches")
+
+def write_zone_windows(competition, seasons):
+    sets = load_sketches(f"{competition}-zones")
+    if sets is None:
+        print(f"No zone sketches stored for {competition}, run zones_retrieve.py --sketches first")
+        return
+    suffix = "career" if seasons is None else f"{seasons}yr"
+    zones = window_table(sets["zones"], seasons, {
+        "for_total" : "for_pSzn", "against_total" : "against_pSzn", "net_total" : "net_pSzn",
+        "transposed_net_p96" : "trans_net_p96", "transposed_net_total" : "trans_net_pSzn"
+    }, season_column="season_name")
+    base_path = output_dir(competition)
+    os.makedirs(base_path, exist_ok=True)
+    write_outputs(zones, f"{base_path}/{suffix}-g+-zones.csv", f"{suffix}-g+-zones", competition, "last_season")
+    print(f"Wrote {len(zones)} {suffix} zone percentiles for {competition} from sketches")
+
+if __name__ == "__main__":
+    from asa_retrieve import competitions
+
+    parser = argparse.ArgumentParser(description="Build career or rolling multi-season G+ percentiles by merging the stored per-season sketches")
+    parser.add_argument("--seasons", type=int, help="rolling windows of this many seasons instead of whole careers")
+    parser.add_argument("--competition", action="append", help="only these competitions (repeatable), defaults to all")
+    args = parser.parse_args()
+    for c in competitions:
+        if args.competition and c["competition"] not in args.competition:
+            continue
+        write_windows(c["competition"], args.seasons)
+        write_zone_windows(c["competition"], args.seasons)
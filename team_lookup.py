@@ -6,10 +6,17 @@ import time
 import datetime
 import os
 
-print(f"assembling player season table based on data from ASA...")
-team_df = pd.read_csv(f"./data/player_lookup.csv")
-team_df["season_name"] = team_df["season_name"].astype(str)
-team_df["season_name"] = team_df["season_name"].str.replace(".0", "")
-team_df = team_df[(team_df.team_id != "All") & (team_df.player_name != "")].drop_duplicates(["competition", "season_name", "team_id"])
-team_df[["competition", "season_name", "team_id"]].to_csv("./data/team_lookup.csv",index=False)
-    
\ No newline at end of file
+from parquet_store import write_outputs
+import membership_index
+from player_lookup import competitions
+
+def main():
+    print(f"assembling team season table from the player membership index...")
+    index = membership_index.load_index()
+    names = { c["competition"] : pd.read_csv(f"./data/{c['competition']}/player_lookup.csv") for c in competitions }
+    team_df = membership_index.team_lookup(membership_index.player_lookup(index, names, list(names.keys())))
+    write_outputs(team_df, "./data/team_lookup.csv", "team_lookup", season_column="season_name")
+    print(f"Wrote {len(team_df)} team seasons")
+
+if __name__ == "__main__":
+    main()
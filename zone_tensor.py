@@ -0,0 +1,157 @@
+import pandas as pd
+import numpy as np
+import os
+import json
+
+from percentiles import base_range, quantile_ladder
+
+zones = list(range(1, 31))
+game_states = list(range(-2, 3))
+fields = ["for", "against", "minutes"]
+
+def output_dir(competition):
+    # mls zone files predate the other competitions and stay at the top of data/
+    return "./data" if competition == "mls" else f"./data/{competition}"
+
+# published next to the competition's zone CSVs, so readers get the tensor without running the pipeline
+def tensor_path(competition):
+    return f"{output_dir(competition)}/team-g+-zones.npy"
+
+def axes_path(competition):
+    return f"{output_dir(competition)}/team-g+-zones.axes.json"
+
+def build_tensor(competition, stripped):
+    # season x team x zone x game state x action type x (for, against, minutes), NaN where ASA had no record, written as a memory-mapped .npy
+    axes = {
+        "season" : sorted(int(s) for s in stripped["season_name"].unique()),
+        "team_id" : sorted(stripped["team_id"].astype(str).unique().tolist()),
+        "zone" : zones,
+        "game_state" : game_states,
+        # action types in the order ASA lists them, so sums over them add up in the same order as a groupby over the rows would
+        "action_type" : pd.unique(stripped["data.action_type"]).tolist(),
+        "field" : fields,
+    }
+    shape = tuple(len(axes[a]) for a in ["season", "team_id", "zone", "game_state", "action_type", "field"])
+    index = (
+        pd.Index(axes["season"]).get_indexer(stripped["season_name"].astype(np.int64)),
+        pd.Index(axes["team_id"]).get_indexer(stripped["team_id"].astype(str)),
+        pd.Index(axes["zone"]).get_indexer(stripped["zone"].astype(np.int64)),
+        pd.Index(axes["game_state"]).get_indexer(stripped["game_state"].astype(np.int64)),
+        pd.Index(axes["action_type"]).get_indexer(stripped["data.action_type"]),
+    )
+
+    # written next to the old tensor and swapped in, readers never see a half written file
+    os.makedirs(output_dir(competition), exist_ok=True)
+    tmp_path = tensor_path(competition) + ".tmp"
+    tensor = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float64, shape=shape)
+    tensor[:] = np.nan
+    tensor[index + (0,)] = stripped["data.goals_added_for"].to_numpy(dtype=np.float64)
+    tensor[index + (1,)] = stripped["data.goals_added_against"].to_numpy(dtype=np.float64)
+    tensor[index + (2,)] = stripped["minutes"].to_numpy(dtype=np.float64)
+    tensor.flush()
+    del tensor
+    # both files are written in full before either replaces the old one, so readers never get a half written axes file
+    with open(axes_path(competition) + ".tmp", "w") as f:
+        json.dump(axes, f)
+    os.replace(tmp_path, tensor_path(competition))
+    os.replace(axes_path(competition) + ".tmp", axes_path(competition))
+    return open_tensor(competition)
+
+def open_tensor(competition, mode = "r"):
+    # (memory-mapped tensor, { axis name : labels }), or (None, None) when zones_retrieve.py hasn't built one
+    if not os.path.exists(tensor_path(competition)):
+        return None, None
+    with open(axes_path(competition)) as f:
+        axes = json.load(f)
+    return np.load(tensor_path(competition), mmap_mode=mode), axes
+
+def compensated_sum(values):
+    # sum over the last axis skipping NaN, with the same Kahan compensation pandas' groupby sum/mean use, so results match them bit for bit
+    total = np.zeros(values.shape[:-1])
+    compensation = np.zeros(values.shape[:-1])
+    count = np.zeros(values.shape[:-1], dtype=np.int64)
+    with np.errstate(invalid="ignore"):
+        for j in range(values.shape[-1]):
+            v = values[..., j]
+            present = ~np.isnan(v)
+            y = v - compensation
+            t = total + y
+            c = (t - total) - y
+            # an infinite value would turn the compensation into NaN, pandas resets it
+            c = np.where(np.isnan(c), 0.0, c)
+            total = np.where(present, t, total)
+            compensation = np.where(present, c, compensation)
+            count += present
+    return total, count
+
+def aggregate(tensor):
+    # per season/team/zone/game state totals over action types, plus the defensive zone mirror (31 - zone is a flip of the zone axis) and net values
+    g_for = tensor[..., 0]
+    g_against = tensor[..., 1]
+    minutes = tensor[..., 2]
+    present = (~np.isnan(minutes)).any(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        minutes_sum, minutes_count = compensated_sum(minutes)
+        metrics = {
+            "minutes" : minutes_sum / minutes_count,
+            "for_total" : compensated_sum(g_for)[0],
+            "against_total" : compensated_sum(g_against)[0],
+            "for_p96" : compensated_sum(g_for * 96 / minutes)[0],
+            "against_p96" : compensated_sum(g_against * 96 / minutes)[0],
+        }
+    for name in ["for_total", "against_total", "for_p96", "against_p96"]:
+        metrics[f"def_{name}"] = np.where(present[:, :, ::-1, :], metrics[name][:, :, ::-1, :], 0.0)
+    metrics["net_p96"] = metrics["for_p96"] - metrics["against_p96"]
+    metrics["net_total"] = metrics["for_total"] - metrics["against_total"]
+    metrics["transposed_net_p96"] = metrics["for_p96"] - metrics["def_for_p96"]
+    metrics["transposed_net_total"] = metrics["for_total"] - metrics["def_against_total"]
+    for values in metrics.values():
+        values[~present] = np.nan
+    return metrics, present
+
+def grouped_frame(axes, metrics, present):
+    # the long season/team/zone/game state frame, one row per record, sorted like a groupby over those keys
+    s, t, z, g = np.nonzero(present)
+    frame = pd.DataFrame({
+        "season_name" : np.asarray(axes["season"])[s],
+        "team_id" : np.asarray(axes["team_id"], dtype=object)[t],
+        "zone" : np.asarray(axes["zone"])[z],
+        "game_state" : np.asarray(axes["game_state"])[g],
+    })
+    frame["minutes"] = metrics["minutes"][present]
+    for name in ["for_total", "against_total", "for_p96", "against_p96"]:
+        frame[name] = metrics[name][present]
+    frame["defensive_zone"] = 31 - frame.zone
+    for name in ["for_total", "against_total", "for_p96", "against_p96"]:
+        frame[f"def_{name}"] = metrics[f"def_{name}"][present]
+    for name in ["net_p96", "net_total", "transposed_net_p96", "transposed_net_total"]:
+        frame[name] = metrics[name][present]
+    return frame
+
+def first_seen(present, axis):
+    # rank of each label by where it first shows up in (season, team, zone, game state) order, the key order group_quantiles gives
+    positions = np.where(present, np.arange(present.size).reshape(present.shape), present.size)
+    first = positions.min(axis=tuple(a for a in range(present.ndim) if a != axis))
+    return np.argsort(np.argsort(first, kind="stable"), kind="stable")
+
+def zone_percentiles(axes, metrics, present, names, q = base_range):
+    # zone x season x game state ladders over teams: sort along the team axis and read every ladder off at once
+    groups = present.any(axis=1).transpose(1, 0, 2)
+    z, s, g = np.nonzero(groups)
+    order = np.lexsort((first_seen(present, 3)[g], first_seen(present, 0)[s], first_seen(present, 2)[z]))
+    z, s, g = z[order], s[order], g[order]
+    n_teams = present.shape[1]
+
+    result = {
+        "zone" : np.repeat(np.asarray(axes["zone"])[z], len(q)),
+        "season_name" : np.repeat(np.asarray(axes["season"])[s], len(q)),
+        "game_state" : np.repeat(np.asarray(axes["game_state"])[g], len(q)),
+        "pct" : np.tile(q, len(z)),
+    }
+    for name in names:
+        # (zone, season, game state, team) with NaN sorting last, so each group's values sit at the front of its row
+        values = np.sort(metrics[name].transpose(2, 0, 3, 1), axis=-1)
+        counts = (~np.isnan(values)).sum(axis=-1)[z, s, g]
+        rows = (z * values.shape[1] + s) * values.shape[2] + g
+        result[name] = quantile_ladder(values.reshape(-1), rows * n_teams, counts, q).ravel()
+    return pd.DataFrame(result)
@@ -1,125 +1,130 @@
 import pandas as pd
 import numpy as np
 import json
-import time
-import datetime
-
-current_date_time = datetime.datetime.now()
-year = current_date_time.date().strftime("%Y")
-year = int(year)
-next_year = int(year) + 1
-
-seasons = range(2013, next_year)
-zones = range(1, 31)
-game_states = range(-2, 3)
-
-gplus_data = pd.DataFrame()
-
-print(f"Grabbing G+ zonal data from ASA...")
-for yr in seasons:
-    print(f"Grabbing ASA data for {yr}")
-    for z in zones:
-        for g in game_states:
-            time.sleep(3)
-            url = f"https://app.americansocceranalysis.com/api/v1/mls/teams/goals-added?zone={z}&season_name={yr}&stage_name=Regular%20Season&gamestate_trunc={g}"
-            print(f"{yr} - accessing ASA zone: {z} with gamestate {g}")
-            tmp = pd.read_json(url)
-            tmp['zone'] = z
-            tmp['season_name'] = yr
-            tmp['game_state'] = g
-            gplus_data = pd.concat([gplus_data, tmp], axis=0, ignore_index=True)
-
-print(f"Found {len(gplus_data)} records of team zone data, exploding to get G+ factors")
-json_expl_txt = json.loads(gplus_data.explode('data').to_json(orient="records"))
-gplus_json_expl_flat = pd.json_normalize(json_expl_txt)
-print(f"Found {len(gplus_json_expl_flat)} records of exploded team zone data, stripping ignored action types")
-stripped_expl_flat = gplus_json_expl_flat[~(gplus_json_expl_flat["data.action_type"].isin(["Claiming", "Interrupting"]))]
-print(f"Found {len(stripped_expl_flat)} records for valid action types in exploded team zone data, writing to data directory")
-stripped_expl_flat.to_csv('./data/team-g+-zones.csv', index=False)
-print(f"Wrote {len(stripped_expl_flat)} records of exploded team zone data to data directory")
-
-print(f"slimming columns...")
-gplus_expl_flat = stripped_expl_flat[["season_name", "team_id", "minutes", "zone", "game_state", "data.action_type", "data.goals_added_for", "data.goals_added_against"]]
-gplus_expl_flat.columns = ["season_name",'team_id', 'minutes', 'zone', "game_state", 'action_type', 'for_total', 'against_total']
-
-print(f"calculating p96 rates for records...")
-gplus_expl_flat['for_p96'] = gplus_expl_flat["for_total"] * 96 / gplus_expl_flat["minutes"]
-gplus_expl_flat['against_p96'] = gplus_expl_flat["against_total"] * 96 / gplus_expl_flat["minutes"]
-
-print(f"Grouping records by season, team, and zone to calculate pctles...")
-grouped_gplus = gplus_expl_flat.groupby(['season_name','team_id','zone', 'game_state']).agg({
-    'minutes' : ['mean'],
-    'for_total': ['sum'], 
-    'against_total': ['sum'], 
-    'for_p96': ['sum'], 
-    'against_p96': ['sum']
-}).reset_index()
-grouped_gplus.columns = grouped_gplus.columns.droplevel(level=1)
-print(f"Found {len(grouped_gplus)} aggregated group records, calculating net vars")
-
-def find_transpose(season, team, zone, game_state, field):
-    print(f"calculating transpose with params: season - {season}, team - {team}, zone - {zone}, game_state - {game_state} and field - {field}")
-    result = grouped_gplus[(grouped_gplus.season_name == season) & (grouped_gplus.game_state == game_state) & (grouped_gplus.team_id == team) & (grouped_gplus.zone == zone)][field].tolist()
-    if len(result) == 0:
-        return 0
-    else:
-        return result[0]
-
-grouped_gplus['defensive_zone'] = 31 - grouped_gplus.zone
-grouped_gplus['def_for_total'] = grouped_gplus.apply(lambda x: find_transpose(x.season_name, x.team_id, x.defensive_zone, x.game_state, 'for_total'), axis=1)
-grouped_gplus['def_against_total'] = grouped_gplus.apply(lambda x: find_transpose(x.season_name, x.team_id, x.defensive_zone, x.game_state, 'against_total'), axis=1)
-grouped_gplus['def_for_p96'] = grouped_gplus.apply(lambda x: find_transpose(x.season_name, x.team_id, x.defensive_zone, x.game_state, 'for_p96'), axis=1)
-grouped_gplus['def_against_p96'] = grouped_gplus.apply(lambda x: find_transpose(x.season_name, x.team_id, x.defensive_zone, x.game_state, 'against_p96'), axis=1)
-
-grouped_gplus['net_p96'] = grouped_gplus['for_p96'] - grouped_gplus['against_p96']
-grouped_gplus['net_total'] = grouped_gplus['for_total'] - grouped_gplus['against_total']
-grouped_gplus['transposed_net_p96'] = grouped_gplus['for_p96'] - grouped_gplus['def_for_p96']
-grouped_gplus['transposed_net_total'] = grouped_gplus['for_total'] - grouped_gplus['def_against_total']
-
-print(f"Calculating percentiles...")
-base_range = np.linspace(0.01, 1.00, 100)
-years = grouped_gplus["season_name"].unique().tolist()
-zones = grouped_gplus["zone"].unique().tolist()
-states = grouped_gplus["game_state"].unique().tolist()
-percentile_composite = pd.DataFrame()
-
-def percentiles(zone, year, game_state):
-    slice_gplus = grouped_gplus[(grouped_gplus.zone == zone) & (grouped_gplus.season_name == year) & (grouped_gplus.game_state == game_state)]
-    if (len(slice_gplus) == 0):
-        #print(f"no data for Combo of {position} / {action_type}")
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from asa_api import AsaClient, season_label
+from asa_retrieve import competitions
+from parquet_store import write_outputs
+from zone_tensor import zones, game_states, build_tensor, tensor_path, output_dir, aggregate, grouped_frame, zone_percentiles
+from sketches import build_sketches, compression_for, save_sketches, default_error
+import instrument
+from instrument import span
+
+client = AsaClient()
+
+def fetch_season(competition, yr):
+    combos = [(z, g) for z in zones for g in game_states]
+    urls = [client.url(f"{competition}/teams/goals-added", zone=z, season_name=season_label(competition, yr), stage_name="Regular Season", gamestate_trunc=g) for (z, g) in combos]
+    print(f"Grabbing {len(urls)} {competition} zone/game state combos for {season_label(competition, yr)}")
+    frames = client.fetch_all(urls)
+    for (z, g), tmp in zip(combos, frames):
+        tmp['zone'] = z
+        tmp['season_name'] = yr
+        tmp['game_state'] = g
+    return pd.concat(frames, axis=0, ignore_index=True)
+
+def process_season(competition, yr, gplus_data):
+    # exploding only looks within one season, so seasons can be processed independently
+    if 'data' not in gplus_data.columns:
+        print(f"No team zone data found for {competition} in {yr}")
+        return pd.DataFrame()
+
+    print(f"Found {len(gplus_data)} records of {competition} team zone data for {yr}, exploding to get G+ factors")
+    with span("zone explode", competition=competition, season=yr) as s:
+        json_expl_txt = json.loads(gplus_data.explode('data').to_json(orient="records"))
+        gplus_json_expl_flat = pd.json_normalize(json_expl_txt)
+        stripped_expl_flat = gplus_json_expl_flat[~(gplus_json_expl_flat["data.action_type"].isin(["Claiming", "Interrupting"]))]
+        s["rows"] = len(stripped_expl_flat)
+    print(f"Found {len(stripped_expl_flat)} records for valid action types in exploded team zone data for {yr}")
+    return stripped_expl_flat
+
+zone_metrics = ["for_p96", "for_total", "against_p96", "against_total", "net_p96", "net_total", "transposed_net_p96", "transposed_net_total"]
+
+def percentiles(axes, metrics, present):
+    # zone x season x game state ladders, in order of each key's first appearance like the old nested loops
+    pct = zone_percentiles(axes, metrics, present, zone_metrics)
+    if (len(pct) == 0):
         return pd.DataFrame()
 
-    data = slice_gplus["for_total"]
-    adj_data = slice_gplus["for_p96"]
-    
-    ag_data = slice_gplus["against_total"]
-    ag_adj_data = slice_gplus["against_p96"]
-    
-    net_data = slice_gplus["net_total"]
-    net_adj_data = slice_gplus["net_p96"]
-        
-    trans_net_data = slice_gplus["transposed_net_total"]
-    trans_net_adj_data = slice_gplus["transposed_net_p96"]
-    
     return pd.DataFrame({ 
-        "season" : year,
-        "zone" : zone, 
-        "game_state" : game_state,
-        "pct" : base_range,
-        "for_p96" : adj_data.quantile(base_range), "for_pSzn" : data.quantile(base_range),
-        "against_p96" : ag_adj_data.quantile(base_range), "against_pSzn" : ag_data.quantile(base_range),
-        "net_p96" : net_adj_data.quantile(base_range), "net_pSzn" : net_data.quantile(base_range),
-        "trans_net_p96" : trans_net_adj_data.quantile(base_range), "trans_net_pSzn" : trans_net_data.quantile(base_range)
+        "season" : pct["season_name"],
+        "zone" : pct["zone"], 
+        "game_state" : pct["game_state"],
+        "pct" : pct["pct"],
+        "for_p96" : pct["for_p96"], "for_pSzn" : pct["for_total"],
+        "against_p96" : pct["against_p96"], "against_pSzn" : pct["against_total"],
+        "net_p96" : pct["net_p96"], "net_pSzn" : pct["net_total"],
+        "trans_net_p96" : pct["transposed_net_p96"], "trans_net_pSzn" : pct["transposed_net_total"]
     })
 
-for z in zones:
-    for y in years:
-        for g in states:
-            print(f"Calculating percentile for zone {z} with gamestate {g} in year {y}...")
-            df = percentiles(z, y, g)
-            print(f"adding {len(df)} records to composite")
-            percentile_composite = pd.concat([percentile_composite, df], ignore_index=True)
-
-print(f"Generated {len(percentile_composite)} composite zone records, writing to data directory")
-percentile_composite.to_csv('./data/percentile-g+-zones.csv', index=False)
-print(f"Wrote {len(percentile_composite)} composite zone records to data directory, pull done")
+def compute_competition(competition, stripped_expl_flat, sketch_error = None):
+    base_path = output_dir(competition)
+    os.makedirs(base_path, exist_ok=True)
+    write_outputs(stripped_expl_flat, f'{base_path}/team-g+-zones.csv', 'team-g+-zones', competition, 'season_name')
+    print(f"Wrote {len(stripped_expl_flat)} records of exploded {competition} team zone data to {base_path}")
+
+    with span("zone tensor", competition=competition) as s:
+        tensor, axes = build_tensor(competition, stripped_expl_flat)
+        s["rows"] = len(stripped_expl_flat)
+    print(f"Stored {competition} zone tensor {dict(zip(['season', 'team', 'zone', 'game_state', 'action_type', 'field'], tensor.shape))} at {tensor_path(competition)}")
+
+    with span("zone aggregate", competition=competition) as s:
+        metrics, present = aggregate(tensor)
+        s["rows"] = int(present.sum())
+    print(f"Found {int(present.sum())} aggregated {competition} team/zone/game state records, calculating percentiles...")
+
+    with span("zone percentiles", competition=competition) as s:
+        percentile_composite = percentiles(axes, metrics, present)
+        s["rows"] = len(percentile_composite)
+    write_outputs(percentile_composite, f'{base_path}/percentile-g+-zones.csv', 'percentile-g+-zones', competition, 'season')
+    print(f"Wrote {len(percentile_composite)} composite {competition} zone records to {base_path}")
+
+    if sketch_error:
+        with span("zone sketches", competition=competition) as s:
+            zone_sketches = build_sketches(grouped_frame(axes, metrics, present), ["season_name", "zone", "game_state"], zone_metrics, compression_for(sketch_error))
+            s["rows"] = len(zone_sketches)
+        save_sketches({ "zones" : zone_sketches }, f"{competition}-zones")
+        print(f"Stored {len(zone_sketches)} {competition} zone/game state sketches")
+
+def run(workers = 1, sketch_error = None, selected = None):
+    print(f"Grabbing G+ zonal data from ASA...")
+    # fetching stays in this process, each season's explode starts as soon as its data is in
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    for c in competitions:
+        competition = c["competition"]
+        if selected and competition not in selected:
+            continue
+        results = []
+        for yr in range(c["start_year"], c["end_year"]):
+            gplus_data = fetch_season(competition, yr)
+            results.append(pool.submit(instrument.collect, instrument.tracing(), process_season, competition, yr, gplus_data) if pool else process_season(competition, yr, gplus_data))
+        if pool:
+            collected = [r.result() for r in results]
+            results = [result for (result, _) in collected]
+            for (_, records) in collected:
+                instrument.record(records)
+
+        stripped_expl_flat = pd.concat(results, ignore_index=True)
+        if len(stripped_expl_flat) == 0:
+            print(f"No team zone data found for {competition}, skipping")
+            continue
+        compute_competition(competition, stripped_expl_flat, sketch_error)
+    if pool:
+        pool.shutdown()
+    print(f"Zone pull done")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh team G+ zone data and percentiles from ASA")
+    parser.add_argument("--workers", type=int, default=1, help="explode seasons on a pool of this many processes")
+    parser.add_argument("--competition", action="append", help="only these competitions (repeatable), defaults to all")
+    parser.add_argument("--report", metavar="PATH", help="write a JSON report of per-stage timings, memory and request counts")
+    parser.add_argument("--sketches", type=float, nargs="?", const=default_error, metavar="ERROR", help=f"also store mergeable quantile sketches for career percentiles, with this rank error (default {default_error})")
+    args = parser.parse_args()
+    if args.report:
+        instrument.start_memory_tracing()
+    run(args.workers, args.sketches, args.competition)
+    if args.report:
+        instrument.write_report(args.report, "zones_retrieve.py", vars(args))